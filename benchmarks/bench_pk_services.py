@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks of the YoutubeService and lastfm.Playlist hot paths :
+throughput (calls/s) and allocations (tracemalloc) per call
+
+    python -m benchmarks.bench_pk_services [-n NUMBER] [-e ENTRIES] [-f FIXTURES]
+"""
+
+import os
+import gc
+import time
+import socket
+import argparse
+import tempfile
+import tracemalloc
+
+from pk_services.youtube import YoutubeService
+from pk_services.lastfm import Playlist
+
+from . import fixtures
+
+# --------------------------------------------------------------------
+
+def _no_network(*args, **kwargs) :
+    raise RuntimeError('benchmarks must not touch the network')
+
+def offline() :
+    socket.socket.connect = _no_network
+    socket.create_connection = _no_network
+
+# --------------------------------------------------------------------
+
+def measure(func, number) :
+    """
+    (calls/s, peak KiB/call, retained KiB/call) of number calls of func
+    """
+    func()
+    gc.collect()
+    start = time.perf_counter()
+    for _ in range(number) :
+        func()
+    elapsed = time.perf_counter() - start
+
+    # mesure séparée : tracemalloc ralentit les appels
+    calls = max(1, number // 10)
+    peak = retained = 0
+    tracemalloc.start()
+    try :
+        for _ in range(calls) :
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            func()
+            after, top = tracemalloc.get_traced_memory()
+            peak += top - before
+            retained += after - before
+    finally :
+        tracemalloc.stop()
+    return number / elapsed, peak / calls / 1024, retained / calls / 1024
+
+def service(infos) :
+    ys = YoutubeService()
+    ys.verbose = False
+    ys._url = infos['webpage_url']
+    ys._set_infos(infos)
+    return ys
+
+def playlist(infos) :
+    Playlist.ytdl_params = { 'quiet' : True }
+    pl = Playlist(batch=len(infos['entries']))
+    pl._infos = infos
+    return pl
+
+# --------------------------------------------------------------------
+
+def cases(entries, recorded) :
+    video = service(fixtures.video_info())
+    yield 'select_format', video.select_format, (720,)
+    yield 'video', video.video, (720,)
+    yield 'get_formats', video.get_formats, ()
+    yield 'selected_formats', lambda : video.selected_formats, ()
+
+    infos = fixtures.playlist_info(entries)
+    ys = service(infos)
+    yield f'playlist[{entries}] set_infos', lambda : ys._set_infos(infos), ()
+    yield f'playlist[{entries}] select_formats', ys.select_formats, (720,)
+
+    def walk() :
+        for num in range(ys.count) :
+            ys.current = num
+            ys.video(720)
+    yield f'playlist[{entries}] video walk', walk, ()
+
+    for name, infos in recorded.items() :
+        if infos.get('_type') == 'playlist' :
+            ys = service(infos)
+            yield f'{name} select_formats', ys.select_formats, (720,)
+        else :
+            ys = service(infos)
+            yield f'{name} video', ys.video, (720,)
+
+    flat = fixtures.flat_playlist(entries * 25)
+    pl = playlist(flat)
+
+    def fill() :
+        pl._cache.clear()
+        pl.cursor.seek(0)
+        pl.extract_info()
+    yield f'lastfm cache[{len(flat["entries"])}] extract_info', fill, ()
+
+    def drain() :
+        pl.restart()
+        while pl.next_entry() :
+            pass
+    yield f'lastfm cache[{len(flat["entries"])}] next_entry', drain, ()
+
+    def m3u() :
+        pl.save_m3u('bench', max_workers=4)
+    yield f'lastfm cache[{len(flat["entries"])}] save_m3u', m3u, ()
+
+def main(argv=None) :
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('-n', '--number', type=int, default=200, help='calls per case')
+    parser.add_argument('-e', '--entries', type=int, default=200, help='playlist fixture size')
+    parser.add_argument('-f', '--fixtures', default=fixtures.location, help='recorded info dicts directory')
+    args = parser.parse_args(argv)
+
+    offline()
+    recorded = fixtures.load(args.fixtures) if os.path.isdir(args.fixtures) else {}
+
+    # save_m3u écrit dans data/
+    with tempfile.TemporaryDirectory() as tmp :
+        os.chdir(tmp)
+        os.mkdir('data')
+        print(f"{'case':<42} {'calls/s':>12} {'peak KiB':>10} {'kept KiB':>10}")
+        for name, func, call_args in cases(args.entries, recorded) :
+            # peu d'appels pour les cas lourds
+            number = args.number if not name.startswith(('playlist', 'lastfm')) else max(1, args.number // 20)
+            rate, peak, retained = measure(lambda : func(*call_args), number)
+            print(f'{name:<42} {rate:>12.1f} {peak:>10.1f} {retained:>10.1f}')
+
+if __name__ == '__main__' :
+    main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+import json
+import pathlib
+import random
+
+# --------------------------------------------------------------------
+# info dicts au format yt-dlp (sanitize_info), sans réseau :
+# générés de façon déterministe, ou rejoués depuis des fichiers
+# enregistrés avec : yt-dlp -J <url> > fixtures/<nom>.json
+
+location = pathlib.Path(__file__).parent / 'fixtures'
+
+HEIGHTS = (144, 240, 360, 480, 720, 1080, 1440, 2160)
+EXPIRE = 4102444800
+
+def _format(video_id, format_id, height=None, vcodec='none', acodec='none', ext='mp4', tbr=None) :
+    url = (
+        f'https://rr1---sn-fixture.googlevideo.com/videoplayback'
+        f'?expire={EXPIRE}&id={video_id}&itag={format_id}&sig=' + 'A' * 96
+    )
+    resolution = f'{height * 16 // 9}x{height}' if height else 'audio only'
+    return {
+        'format_id' : format_id,
+        'format' : f'{format_id} - {resolution}',
+        'format_note' : f'{height}p' if height else 'medium',
+        'url' : url,
+        'ext' : ext,
+        'protocol' : 'https',
+        'vcodec' : vcodec,
+        'acodec' : acodec,
+        'width' : height * 16 // 9 if height else None,
+        'height' : height,
+        'fps' : 30 if height else None,
+        'tbr' : tbr,
+        'resolution' : resolution,
+        'http_headers' : { 'User-Agent' : 'Mozilla/5.0' },
+    }
+
+def video_info(num=0, seed=0) :
+    """
+    Single video with about 30 formats : progressive, video only
+    (avc1, vp9) and audio only
+    """
+    rnd = random.Random(f'{seed}-{num}')
+    video_id = f'vid{num:08d}'
+    formats = [
+        _format(video_id, '139', acodec='mp4a.40.5', ext='m4a', tbr=49),
+        _format(video_id, '140', acodec='mp4a.40.2', ext='m4a', tbr=129),
+        _format(video_id, '251', acodec='opus', ext='webm', tbr=135),
+        _format(video_id, '18', 360, 'avc1.42001E', 'mp4a.40.2', tbr=500),
+    ]
+    for i, height in enumerate(HEIGHTS) :
+        tbr = height * rnd.uniform(2.5, 3.5)
+        formats.append(_format(video_id, str(160 + i), height, 'avc1.4d401f', tbr=tbr))
+        formats.append(_format(video_id, str(278 + i), height, 'vp9', ext='webm', tbr=tbr * 0.8))
+        formats.append(_format(video_id, str(394 + i), height, 'av01.0.05M.08', tbr=tbr * 0.6))
+    best = formats[-1]
+    audio = formats[1]
+    return {
+        'id' : video_id,
+        'title' : f'Fixture video {num}',
+        'duration' : rnd.randint(60, 3600),
+        'webpage_url' : f'https://www.youtube.com/watch?v={video_id}',
+        'extractor' : 'youtube',
+        'extractor_key' : 'Youtube',
+        'formats' : formats,
+        'requested_formats' : [best, audio],
+        'format_id' : f"{best['format_id']}+{audio['format_id']}",
+        'format' : f"{best['format']}+{audio['format']}",
+        'url' : None,
+        'height' : best['height'],
+        'resolution' : best['resolution'],
+        'ext' : 'mp4',
+    }
+
+def playlist_info(count=200, seed=0) :
+    """
+    Playlist of count fully resolved videos
+    """
+    return {
+        '_type' : 'playlist',
+        'id' : 'PLfixture',
+        'title' : 'Fixture playlist',
+        'webpage_url' : 'https://www.youtube.com/playlist?list=PLfixture',
+        'n_entries' : count,
+        'entries' : [
+            # champs de playlist ajoutés par yt-dlp à chaque entrée
+            dict(video_info(num, seed), n_entries=count, playlist_index=num + 1, playlist_id='PLfixture')
+            for num in range(count)
+        ],
+    }
+
+def flat_playlist(count=5000) :
+    """
+    Flat playlist (extract_info process=False) : url entries only
+    """
+    return {
+        '_type' : 'playlist',
+        'id' : 'PLflat',
+        'title' : 'Fixture flat playlist',
+        'entries' : [
+            {
+                '_type' : 'url',
+                'ie_key' : 'Youtube',
+                'id' : f'vid{num:08d}',
+                'url' : f'https://www.youtube.com/watch?v=vid{num:08d}',
+                'title' : f'Fixture video {num}',
+                'duration' : 60 + num % 3600,
+            }
+            for num in range(count)
+        ],
+    }
+
+def load(directory=location) :
+    """
+    Recorded info dicts of directory, by file stem
+    """
+    fixtures = {}
+    for path in sorted(pathlib.Path(directory).glob('*.json')) :
+        with open(path, 'r', encoding='utf-8') as fd :
+            fixtures[path.stem] = json.load(fd)
+    return fixtures
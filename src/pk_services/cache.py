@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+
+# logging
+import logging
+log = logging.getLogger(__name__)
+log.debug('MODULE {}'.format(__name__))
+
+import os
+import re
+import json
+import time
+import hashlib
+import pathlib
+import tempfile
+import threading
+import collections
+import urllib.parse
+
+import requests
+
+from .core import LRUCache
+
+__all__ = [ 'ResponseCache', 'InfoCache', 'PageCache', 'url_expiry', 'info_expiry' ]
+
+# --------------------------------------------------------------------
+
+def _atomic_write(path, data) :
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try :
+        with os.fdopen(fd, 'wb') as f :
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException :
+        pathlib.Path(tmp).unlink(missing_ok=True)
+        raise
+
+# --------------------------------------------------------------------
+
+class ResponseCache :
+    """
+    On-disk HTTP response cache, LRU eviction under a size cap.
+    Only responses carrying a validator (ETag / Last-Modified) are kept,
+    so that every hit can be revalidated with a conditional request.
+    """
+
+    def __init__(self, directory, max_size=64*1024*1024) :
+        self._directory = pathlib.Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._index = collections.OrderedDict()
+        self._size = 0
+        self._load_index()
+
+    def _load_index(self) :
+        # l'ordre LRU est reconstruit à partir des dates de modification
+        metas = sorted(
+            self._directory.glob('*.json'),
+            key=lambda p : p.stat().st_mtime
+        )
+        for meta_path in metas :
+            body_path = meta_path.with_suffix('.body')
+            if not body_path.exists() :
+                meta_path.unlink(missing_ok=True)
+                continue
+            size = body_path.stat().st_size
+            self._index[meta_path.stem] = size
+            self._size += size
+
+    @staticmethod
+    def key(url) :
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _paths(self, key) :
+        return (
+            self._directory / f'{key}.json',
+            self._directory / f'{key}.body'
+        )
+
+    @property
+    def directory(self) :
+        return self._directory
+
+    @property
+    def max_size(self) :
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, max_size) :
+        with self._lock :
+            self._max_size = max_size
+            self._evict()
+
+    @property
+    def size(self) :
+        return self._size
+
+    def __len__(self) :
+        return len(self._index)
+
+    def __contains__(self, url) :
+        return self.key(url) in self._index
+
+    def _touch(self, key) :
+        self._index.move_to_end(key)
+        meta_path, _ = self._paths(key)
+        try :
+            os.utime(meta_path)
+        except OSError :
+            pass
+
+    def _remove(self, key) :
+        size = self._index.pop(key, 0)
+        self._size -= size
+        for path in self._paths(key) :
+            path.unlink(missing_ok=True)
+
+    def _evict(self) :
+        while self._size > self._max_size and self._index :
+            key = next(iter(self._index))
+            log.debug(f'evict {key}')
+            self._remove(key)
+
+    def _read_meta(self, key) :
+        meta_path, _ = self._paths(key)
+        try :
+            with open(meta_path, 'r', encoding='utf-8') as fd :
+                return json.load(fd)
+        except (OSError, ValueError) :
+            return None
+
+    def conditional_headers(self, url) :
+        """
+        Headers If-None-Match / If-Modified-Since for a cached url
+        """
+        key = self.key(url)
+        with self._lock :
+            if key not in self._index :
+                return {}
+            meta = self._read_meta(key)
+        if meta is None :
+            return {}
+
+        headers = {}
+        validators = requests.structures.CaseInsensitiveDict(meta['headers'])
+        if 'ETag' in validators :
+            headers['If-None-Match'] = validators['ETag']
+        if 'Last-Modified' in validators :
+            headers['If-Modified-Since'] = validators['Last-Modified']
+        return headers
+
+    def revalidated(self, url, response) :
+        """
+        Build the cached response for a 304 answer, None if it is gone
+        """
+        key = self.key(url)
+        meta_path, body_path = self._paths(key)
+        with self._lock :
+            if key not in self._index :
+                return None
+            meta = self._read_meta(key)
+            try :
+                body = body_path.read_bytes()
+            except OSError :
+                meta = None
+            if meta is None :
+                self._remove(key)
+                return None
+
+            # un 304 peut mettre à jour les en-têtes de l'entrée
+            headers = requests.structures.CaseInsensitiveDict(meta['headers'])
+            headers.update(response.headers)
+            headers.pop('Content-Length', None)
+            meta['headers'] = dict(headers)
+            _atomic_write(meta_path, json.dumps(meta).encode('utf-8'))
+            self._touch(key)
+
+        cached = requests.Response()
+        cached.status_code = meta['status']
+        cached.reason = meta.get('reason')
+        cached.headers = headers
+        cached.encoding = meta.get('encoding')
+        cached.url = meta['url']
+        cached.request = response.request
+        cached._content = body
+        cached.from_cache = True
+        return cached
+
+    def store(self, url, response) :
+        """
+        Store a 200 response carrying a validator
+        """
+        if response.status_code != 200 :
+            return False
+        if 'no-store' in response.headers.get('Cache-Control', '') :
+            return False
+        if ( 'ETag' not in response.headers
+             and 'Last-Modified' not in response.headers ) :
+            return False
+
+        body = response.content
+        if len(body) > self._max_size :
+            return False
+
+        meta = {
+            'url' : response.url,
+            'status' : response.status_code,
+            'reason' : response.reason,
+            'encoding' : response.encoding,
+            'headers' : dict(response.headers),
+        }
+        # le corps est stocké décodé : supprimer l'encodage de transfert
+        meta['headers'].pop('Content-Encoding', None)
+        meta['headers'].pop('Content-Length', None)
+
+        key = self.key(url)
+        meta_path, body_path = self._paths(key)
+        with self._lock :
+            self._remove(key)
+            _atomic_write(body_path, body)
+            _atomic_write(meta_path, json.dumps(meta).encode('utf-8'))
+            self._index[key] = len(body)
+            self._size += len(body)
+            self._evict()
+        return True
+
+    def clear(self) :
+        with self._lock :
+            for key in list(self._index) :
+                self._remove(key)
+
+# --------------------------------------------------------------------
+
+_re_path_expire = re.compile(r'/expire/(\d+)')
+
+def url_expiry(url) :
+    """
+    Expiry timestamp of a signed media url, from its 'expire' query
+    parameter or '/expire/<ts>/' path segment, None if there is none
+    """
+    split = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qs(split.query)
+    for name in ('expire', 'expires', 'Expires') :
+        if name in query :
+            try :
+                return int(query[name][0])
+            except ValueError :
+                pass
+    match = _re_path_expire.search(split.path)
+    if match :
+        return int(match.group(1))
+    return None
+
+def info_expiry(info) :
+    """
+    Earliest expiry of the media urls found in an info dict
+    """
+    expiries = []
+    stack = [info]
+    while stack :
+        item = stack.pop()
+        if isinstance(item, dict) :
+            for key, value in item.items() :
+                if key in ('url', 'manifest_url') and isinstance(value, str) :
+                    expiry = url_expiry(value)
+                    if expiry is not None :
+                        expiries.append(expiry)
+                elif isinstance(value, (dict, list)) :
+                    stack.append(value)
+        elif isinstance(item, list) :
+            stack.extend(item)
+    return min(expiries, default=None)
+
+# --------------------------------------------------------------------
+
+class InfoCache :
+    """
+    On-disk cache of sanitized info dicts. Metadata (title, duration,
+    formats...) live ttl seconds, stream urls only until the expiry
+    embedded in the signed urls, minus a safety margin
+    """
+
+    def __init__(self, directory, ttl=7*24*3600, stream_ttl=3600, margin=300) :
+        self._directory = pathlib.Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        # urls sans expiration connue
+        self.stream_ttl = stream_ttl
+        self.margin = margin
+
+    @property
+    def directory(self) :
+        return self._directory
+
+    def _path(self, key) :
+        return self._directory / f'{ResponseCache.key(key)}.json'
+
+    def _read(self, key) :
+        path = self._path(key)
+        try :
+            with open(path, 'r', encoding='utf-8') as fd :
+                entry = json.load(fd)
+        except (OSError, ValueError) :
+            return None
+        if time.time() > entry['expires'] :
+            path.unlink(missing_ok=True)
+            return None
+        return entry
+
+    def get(self, key, streams=True) :
+        """
+        Cached info dict, None if missing or expired ;
+        with streams=False, stale stream urls are accepted
+        """
+        entry = self._read(key)
+        if entry is None :
+            return None
+        if streams and time.time() > entry['streams_expires'] :
+            log.debug(f'stream urls expired - {key}')
+            return None
+        return entry['info']
+
+    def streams_expires(self, key) :
+        entry = self._read(key)
+        return None if entry is None else entry['streams_expires']
+
+    def store(self, key, info) :
+        now = time.time()
+        expiry = info_expiry(info)
+        if expiry is None :
+            streams_expires = now + self.stream_ttl
+        else :
+            streams_expires = expiry - self.margin
+        entry = {
+            'key' : key,
+            'created' : now,
+            'expires' : now + self.ttl,
+            'streams_expires' : min(streams_expires, now + self.ttl),
+            'info' : info,
+        }
+        try :
+            _atomic_write(self._path(key), json.dumps(entry).encode('utf-8'))
+        except (TypeError, ValueError) as e :
+            # info non sérialisable (erreur...) : pas de cache
+            log.debug(f'not cached - {key} : {e}')
+            return False
+        return True
+
+    def remove(self, key) :
+        self._path(key).unlink(missing_ok=True)
+
+    def purge(self) :
+        """
+        Remove expired entries
+        """
+        for path in self._directory.glob('*.json') :
+            try :
+                with open(path, 'r', encoding='utf-8') as fd :
+                    expires = json.load(fd)['expires']
+            except (OSError, ValueError, KeyError) :
+                expires = 0
+            if time.time() > expires :
+                path.unlink(missing_ok=True)
+
+# --------------------------------------------------------------------
+
+class PageCache :
+    """
+    In-memory cache of parsed pages by final url, for ttl seconds ;
+    the requested urls (before redirects) are aliases of the final one
+    """
+
+    def __init__(self, ttl=600, maxsize=64) :
+        self.ttl = ttl
+        self._pages = LRUCache(maxsize)
+        # alias orphelins : bornés comme les pages
+        self._aliases = LRUCache(4 * maxsize)
+
+    def __len__(self) :
+        return len(self._pages)
+
+    def __contains__(self, url) :
+        return self.get(url) is not None
+
+    def get(self, url) :
+        final_url = self._aliases.get(url, url)
+        entry = self._pages.get(final_url)
+        if entry is None :
+            return None
+        expires, page = entry
+        if time.monotonic() > expires :
+            self._pages.pop(final_url)
+            return None
+        return page
+
+    def store(self, url, final_url, page) :
+        self._pages.set(final_url, (time.monotonic() + self.ttl, page))
+        if url != final_url :
+            self._aliases.set(url, final_url)
+
+    def remove(self, url) :
+        self._pages.pop(self._aliases.pop(url, url))
+
+    def clear(self) :
+        self._pages.clear()
+        self._aliases.clear()
+
+# --------------------------------------------------------------------
@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
 
+import abc
 import os
+import json
 import socks
 import socket
+import itertools
+import threading
+import contextlib
+import collections
 
-__all__ = [ 'Tor', 'Service' ]
+__all__ = [ 'Tor', 'Service', 'ObjectPool', 'LRUCache' ]
 
 # ---
 
@@ -46,3 +52,115 @@ class Service :
     @opener.setter
     def opener(self, opener) :
         self._opener = opener
+
+# ---
+
+class ObjectPool(abc.ABC) :
+    """
+    Pool of reusable objects keyed by their params : an object is
+    checked out by one thread at a time, then kept idle (at most
+    maxsize per key) for the next checkout ; subclasses implement
+    _create
+    """
+
+    def __init__(self, maxsize=4) :
+        self._maxsize = maxsize
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(params) :
+        # objets (logger...) identifiés par leur id
+        return json.dumps(
+            params, sort_keys=True,
+            default=lambda o : f'{type(o).__name__}@{id(o)}'
+        )
+
+    def __len__(self) :
+        return sum(len(idle) for idle in self._idle.values())
+
+    @abc.abstractmethod
+    def _create(self, params) :
+        pass
+
+    def _close(self, obj) :
+        obj.close()
+
+    @contextlib.contextmanager
+    def checkout(self, params=None) :
+        key = self.key(params)
+        with self._lock :
+            idle = self._idle.get(key)
+            obj = idle.pop() if idle else None
+        if obj is None :
+            obj = self._create(params)
+        try :
+            yield obj
+        finally :
+            self._checkin(key, obj)
+
+    def create(self, params=None) :
+        """
+        New object outside the pool, owned and closed by the caller
+        """
+        return self._create(params)
+
+    def _checkin(self, key, obj) :
+        with self._lock :
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self._maxsize :
+                idle.append(obj)
+                return
+        self._close(obj)
+
+    def warm(self, params=None, count=1) :
+        """
+        Build count objects ahead of the first checkout
+        """
+        key = self.key(params)
+        for _ in range(count) :
+            self._checkin(key, self._create(params))
+
+    def clear(self) :
+        with self._lock :
+            idle, self._idle = self._idle, {}
+        for obj in itertools.chain.from_iterable(idle.values()) :
+            self._close(obj)
+
+# ---
+
+class LRUCache :
+    """
+    Bounded, thread-safe mapping evicting the least recently used key
+    """
+
+    def __init__(self, maxsize=4096) :
+        self._maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) :
+        return len(self._data)
+
+    def get(self, key, default=None) :
+        with self._lock :
+            try :
+                self._data.move_to_end(key)
+                return self._data[key]
+            except KeyError :
+                return default
+
+    def set(self, key, value) :
+        with self._lock :
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize :
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None) :
+        with self._lock :
+            return self._data.pop(key, default)
+
+    def clear(self) :
+        with self._lock :
+            self._data.clear()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+# logging
+import logging
+log = logging.getLogger(__name__)
+log.debug('MODULE {}'.format(__name__))
+
+import math
+import time
+import hashlib
+import threading
+import collections
+import urllib.parse
+import concurrent.futures
+
+from .web import GrabService, urljoin_many
+from .parsers import ImageLinkHTMLParser
+from .exceptions import ServiceError
+
+__all__ = [ 'BloomFilter', 'GrabCrawler' ]
+
+# --------------------------------------------------------------------
+
+class BloomFilter :
+    """
+    Compact set of strings with a bounded false positive rate :
+    about 2.4 MB for a million urls at 1e-4
+    """
+
+    def __init__(self, capacity=1000000, error_rate=1e-4) :
+        self._size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hashes = max(1, round(self._size / capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) :
+        # nombre d'ajouts effectifs
+        return self._count
+
+    def __contains__(self, item) :
+        return all(
+            self._bits[i >> 3] & (1 << (i & 7))
+            for i in self._positions(item)
+        )
+
+    def _positions(self, item) :
+        # double hachage : h1 + i.h2
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [ (h1 + i * h2) % self._size for i in range(self._hashes) ]
+
+    def add(self, item) :
+        """
+        Add item, return False if it was (probably) already there
+        """
+        positions = self._positions(item)
+        with self._lock :
+            new = False
+            for i in positions :
+                mask = 1 << (i & 7)
+                if not self._bits[i >> 3] & mask :
+                    self._bits[i >> 3] |= mask
+                    new = True
+            if new :
+                self._count += 1
+        return new
+
+# --------------------------------------------------------------------
+
+class GrabCrawler :
+    """
+    Multi-page crawler over a GrabService : frontier queue fed by the
+    'next page' XPath of DomainParserConfig, seen urls in a BloomFilter,
+    depth and page limits, per-host delay between requests
+    """
+
+    def __init__(self, grab=None, max_depth=10, max_pages=100, delay=1.0, max_workers=4, capacity=1000000) :
+        self.grab = grab or GrabService()
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.delay = delay
+        self.max_workers = max_workers
+        self._seen = BloomFilter(capacity)
+        self._lock = threading.Lock()
+        self._next_time = {}
+
+    @property
+    def seen(self) :
+        return self._seen
+
+    def _wait_turn(self, url) :
+        # réserve le prochain créneau de l'hôte, puis attend son heure
+        host = self.grab.domain(url)
+        with self._lock :
+            now = time.monotonic()
+            turn = max(now, self._next_time.get(host, now))
+            self._next_time[host] = turn + self.delay
+        if turn > now :
+            time.sleep(turn - now)
+
+    def _crawl_page(self, url) :
+        parser = ImageLinkHTMLParser(self.grab.parser.config, self.grab.parser.paired)
+        self._wait_turn(url)
+        response = self.grab.get(url)
+        parser.parse(self.grab.decode(response), url)
+        images_links = self.grab._filter(url, parser.images_links)
+        return images_links, urljoin_many(url, parser.next_pages)
+
+    def _add(self, frontier, url, depth) :
+        url = urllib.parse.urldefrag(url).url
+        if depth <= self.max_depth and self._seen.add(url) :
+            frontier.append((url, depth))
+
+    def crawl(self, *urls) :
+        """
+        Crawl from urls, yield (image, link) pairs page after page
+        """
+        frontier = collections.deque()
+        for url in urls :
+            self._add(frontier, url, 0)
+
+        pages = 0
+        pending = {}
+        executor = concurrent.futures.ThreadPoolExecutor(self.max_workers)
+        try :
+            while frontier or pending :
+                while frontier and len(pending) < self.max_workers and pages < self.max_pages :
+                    url, depth = frontier.popleft()
+                    pending[executor.submit(self._crawl_page, url)] = (url, depth)
+                    pages += 1
+                if not pending :
+                    break
+
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done :
+                    url, depth = pending.pop(future)
+                    try :
+                        images_links, next_pages = future.result()
+                    except ServiceError as e :
+                        log.error(f'ServiceError - {e}')
+                        continue
+                    except Exception as e :
+                        # une page illisible n'arrête pas l'exploration
+                        log.error(f'{type(e).__name__} - {url} : {e}')
+                        continue
+                    log.debug(f'crawl : {url} depth={depth} images={len(images_links)}')
+                    for next_page in next_pages :
+                        self._add(frontier, next_page, depth + 1)
+                    yield from images_links.items()
+        finally :
+            executor.shutdown(wait=True, cancel_futures=True)
+
+# --------------------------------------------------------------------
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# logging
+import logging
+log = logging.getLogger(__name__)
+log.debug('MODULE {}'.format(__name__))
+
+import pathlib
+
+__all__ = [ 'DomainIndex', 'PublicSuffixList' ]
+
+# liste réduite livrée avec le paquet, format publicsuffix.org
+BUNDLED_PSL = pathlib.Path(__file__).with_name('public_suffix_list.dat')
+
+# --------------------------------------------------------------------
+
+class DomainIndex :
+    """
+    Reversed-label trie of domains : find the most specific domain
+    configured for a host, 'www.example.co.uk' -> 'example.co.uk'
+    """
+
+    _terminal = None
+
+    def __init__(self, domains=()) :
+        self._root = {}
+        self._size = 0
+        for domain in domains :
+            self.add(domain)
+
+    def __len__(self) :
+        return self._size
+
+    @staticmethod
+    def labels(host) :
+        return reversed(host.lower().strip('.').split('.'))
+
+    def add(self, domain) :
+        node = self._root
+        for label in self.labels(domain) :
+            node = node.setdefault(label, {})
+        if self._terminal not in node :
+            self._size += 1
+        node[self._terminal] = domain
+
+    def find(self, host) :
+        node = self._root
+        found = None
+        for label in self.labels(host) :
+            node = node.get(label)
+            if node is None :
+                break
+            found = node.get(self._terminal, found)
+        return found
+
+# --------------------------------------------------------------------
+
+class PublicSuffixList :
+    """
+    Public suffix rules (publicsuffix.org format) : normal, wildcard
+    '*.' and exception '!' rules, longest match wins
+    """
+
+    def __init__(self, lines=()) :
+        self._rules = set()
+        self._wildcards = set()
+        self._exceptions = set()
+        self.update(lines)
+
+    @classmethod
+    def load(cls, filename=None) :
+        with open(filename or BUNDLED_PSL, 'r', encoding='utf-8') as fd :
+            return cls(fd)
+
+    def update(self, lines) :
+        for line in lines :
+            line = line.strip()
+            if not line or line.startswith('//') :
+                continue
+            rule = line.split()[0].lower()
+            if rule.startswith('!') :
+                self._exceptions.add(rule[1:])
+            elif rule.startswith('*.') :
+                self._wildcards.add(rule[2:])
+            else :
+                self._rules.add(rule)
+
+    def public_suffix(self, host) :
+        labels = host.lower().strip('.').split('.')
+        for i in range(len(labels)) :
+            candidate = '.'.join(labels[i:])
+            if candidate in self._exceptions :
+                return '.'.join(labels[i+1:])
+            if candidate in self._rules :
+                return candidate
+            if '.'.join(labels[i+1:]) in self._wildcards :
+                return candidate
+        # règle implicite '*' : le dernier label
+        return labels[-1]
+
+    def is_public_suffix(self, domain) :
+        return self.public_suffix(domain) == domain.lower().strip('.')
+
+    def registered_domain(self, host) :
+        """
+        Public suffix plus one label, None for a bare suffix
+        """
+        host = host.lower().strip('.')
+        suffix = self.public_suffix(host)
+        if suffix == host :
+            return None
+        labels = host[:-len(suffix)-1].split('.')
+        return f'{labels[-1]}.{suffix}'
+
+# --------------------------------------------------------------------
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+# logging
+import logging
+log = logging.getLogger(__name__)
+log.debug('MODULE {}'.format(__name__))
+
+import os
+import time
+import hashlib
+import pathlib
+import threading
+import urllib.parse
+import concurrent.futures
+
+import requests
+
+from .web import WebService
+from .exceptions import ServiceError
+
+__all__ = [ 'DownloadStats', 'DownloadService' ]
+
+# --------------------------------------------------------------------
+
+class DownloadStats :
+    """
+    Counters of a download run, shared by the workers
+    """
+
+    def __init__(self) :
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self.files = 0
+        self.bytes = 0
+        self.resumed = 0
+        self.duplicates = 0
+        self.bytes_saved = 0
+        self.errors = 0
+
+    def __str__(self) :
+        return (
+            f'{self.files} files, {self.bytes} bytes in {self.elapsed:.1f}s'
+            f' ({self.throughput/1024:.1f} KiB/s), {self.resumed} resumed,'
+            f' {self.duplicates} duplicates ({self.bytes_saved} bytes saved),'
+            f' {self.errors} errors'
+        )
+
+    def add(self, **counters) :
+        with self._lock :
+            for name, value in counters.items() :
+                setattr(self, name, getattr(self, name) + value)
+
+    @property
+    def elapsed(self) :
+        return time.monotonic() - self._started
+
+    @property
+    def throughput(self) :
+        # octets par seconde
+        return self.bytes / max(self.elapsed, 1e-6)
+
+# --------------------------------------------------------------------
+
+class DownloadService(WebService) :
+    """
+    Concurrent streaming downloads into a directory : files are written
+    in chunks, partial files resumed with Range requests, and contents
+    already stored (same sha256) are not kept twice
+    """
+
+    def __init__(self, opener=None, directory='.', max_workers=4, chunk_size=64*1024, **kwargs) :
+        super().__init__(opener, **kwargs)
+        self.directory = directory
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.stats = DownloadStats()
+        self._lock = threading.Lock()
+        self._hashes = {}
+
+    @property
+    def directory(self) :
+        return self._directory
+
+    @directory.setter
+    def directory(self, directory) :
+        self._directory = pathlib.Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+    def scan(self) :
+        """
+        Hash the files already in the directory, for dedup across runs
+        """
+        for path in self.directory.iterdir() :
+            if path.is_file() and not path.name.endswith('.part') :
+                digest = hashlib.sha256()
+                self._hash_file(path, digest)
+                with self._lock :
+                    self._hashes.setdefault(digest.hexdigest(), path)
+
+    def _hash_file(self, path, digest) :
+        with open(path, 'rb') as fd :
+            for chunk in iter(lambda : fd.read(self.chunk_size), b'') :
+                digest.update(chunk)
+
+    def filename(self, url) :
+        name = os.path.basename(urllib.parse.unquote(urllib.parse.urlsplit(url).path))
+        return name or hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _part(self, url) :
+        # un fichier partiel par url : reprise possible, pas de collision
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+        return self.directory / f'.{key}.part'
+
+    def _fetch(self, url, part, digest) :
+        offset = part.stat().st_size if part.exists() else 0
+        headers = { 'Range' : f'bytes={offset}-' } if offset else None
+        try :
+            response = self.get(url, stream=True, headers=headers)
+        except ServiceError as e :
+            if not offset or self._status(e) != 416 :
+                # autre erreur : le fichier partiel est conservé
+                raise
+            # plage refusée : le fichier a changé, repartir de zéro
+            log.debug(f'restart - {url}')
+            part.unlink(missing_ok=True)
+            return self._fetch(url, part, digest)
+
+        try :
+            if offset and response.status_code == 206 :
+                self._hash_file(part, digest)
+                self.stats.add(resumed=1)
+                mode = 'ab'
+            else :
+                mode = 'wb'
+            with open(part, mode) as fd :
+                for chunk in response.iter_content(self.chunk_size) :
+                    fd.write(chunk)
+                    digest.update(chunk)
+                    self.stats.add(bytes=len(chunk))
+        except requests.RequestException as e :
+            # le fichier partiel est conservé pour une reprise
+            raise ServiceError(f'{type(e).__name__} - {e}')
+        finally :
+            response.close()
+
+    @staticmethod
+    def _status(error) :
+        # statut HTTP de l'erreur d'origine, None sans réponse
+        response = getattr(error.__cause__, 'response', None)
+        return None if response is None else response.status_code
+
+    def _download(self, url) :
+        part = self._part(url)
+        digest = hashlib.sha256()
+        self._fetch(url, part, digest)
+        digest = digest.hexdigest()
+        size = part.stat().st_size
+
+        with self._lock :
+            existing = self._hashes.get(digest)
+            if existing is not None and existing.exists() :
+                log.debug(f'duplicate - {url} = {existing}')
+                part.unlink()
+                self.stats.add(duplicates=1, bytes_saved=size)
+                return existing
+
+            target = self.directory / self.filename(url)
+            if target.exists() :
+                target = target.with_stem(f'{target.stem}-{digest[:8]}')
+            os.replace(part, target)
+            self._hashes[digest] = target
+
+        self.stats.add(files=1)
+        return target
+
+    def download(self, urls) :
+        """
+        Download urls concurrently, yield (url, path) as completed,
+        path is None when the download failed
+        """
+        self.stats = DownloadStats()
+        executor = concurrent.futures.ThreadPoolExecutor(self.max_workers)
+        try :
+            futures = { executor.submit(self._download, url) : url for url in urls }
+            for future in concurrent.futures.as_completed(futures) :
+                url = futures[future]
+                try :
+                    yield url, future.result()
+                except (ServiceError, OSError) as e :
+                    log.error(f'ServiceError - {e}')
+                    self.stats.add(errors=1)
+                    yield url, None
+        finally :
+            executor.shutdown(wait=True, cancel_futures=True)
+            log.info(f'download : {self.stats}')
+
+    def download_images(self, grab) :
+        """
+        Download the images of a GrabService
+        """
+        return self.download(grab.images)
+
+# --------------------------------------------------------------------
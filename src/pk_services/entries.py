@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+# logging
+import logging
+log = logging.getLogger(__name__)
+log.debug('MODULE {}'.format(__name__))
+
+import threading
+import collections
+
+from yt_dlp.utils import LazyList, PagedList
+
+__all__ = [ 'Entry', 'EntryStore', 'PlaylistCursor' ]
+
+# --------------------------------------------------------------------
+
+class Entry :
+    """
+    Compact playlist entry : what is needed to list, save or resolve
+    a video, instead of the whole yt-dlp dict
+    """
+
+    __slots__ = ( 'id', 'url', 'title', 'duration', 'ie_key', 'attrs' )
+
+    def __init__(self, url, id=None, title=None, duration=None, ie_key=None, attrs=None) :
+        self.url = url
+        self.id = id
+        self.title = title
+        self.duration = duration
+        self.ie_key = ie_key
+        # attributs #EXTINF (tvg-logo, group-title...), None si aucun
+        self.attrs = attrs
+
+    @classmethod
+    def from_info(cls, info) :
+        duration = info.get('duration')
+        # 'url' d'une vidéo résolue : url du flux, pas de la page
+        if info.get('_type') in ( 'url', 'url_transparent' ) :
+            url = info.get('url')
+        else :
+            url = info.get('webpage_url') or info.get('url')
+        return cls(
+            url,
+            id=info.get('id'),
+            title=info.get('title'),
+            duration=None if duration is None else int(duration),
+            ie_key=info.get('ie_key') or info.get('extractor_key'),
+        )
+
+    @property
+    def key(self) :
+        # identifiant d'extracteur si connu, sinon l'url
+        return (self.ie_key, self.id) if self.id else self.url
+
+    def ie_result(self) :
+        """
+        yt-dlp url result, to be resolved with process_ie_result
+        """
+        ie_result = { '_type' : 'url', 'url' : self.url }
+        for name in ( 'id', 'title', 'duration', 'ie_key' ) :
+            value = getattr(self, name)
+            if value is not None :
+                ie_result[name] = value
+        return ie_result
+
+    def __eq__(self, other) :
+        if not isinstance(other, Entry) :
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self) :
+        return f'Entry(url={self.url!r}, title={self.title!r}, duration={self.duration!r})'
+
+# --------------------------------------------------------------------
+
+class EntryStore :
+    """
+    Bounded, de-duplicated and ordered store of entries : an entry
+    already present keeps its place, the oldest ones are evicted
+    beyond maxsize
+    """
+
+    def __init__(self, entries=(), maxsize=10000) :
+        self._maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # entrées retirées au delà de maxsize
+        self.evicted = 0
+        self.extend(entries)
+
+    def __len__(self) :
+        return len(self._entries)
+
+    def __contains__(self, entry) :
+        return entry.key in self._entries
+
+    def __iter__(self) :
+        # instantané : le store peut être complété pendant le parcours
+        with self._lock :
+            return iter(list(self._entries.values()))
+
+    def __getitem__(self, index) :
+        with self._lock :
+            entries = list(self._entries.values())
+        return entries[index]
+
+    @property
+    def maxsize(self) :
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, maxsize) :
+        with self._lock :
+            self._maxsize = maxsize
+            self._evict()
+
+    def _evict(self) :
+        while len(self._entries) > self._maxsize :
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+    def add(self, entry) :
+        """
+        Add an Entry or an info dict, False if already there
+        """
+        if not isinstance(entry, Entry) :
+            entry = Entry.from_info(entry)
+        with self._lock :
+            if entry.key in self._entries :
+                return False
+            self._entries[entry.key] = entry
+            self._evict()
+            return entry.key in self._entries
+
+    def extend(self, entries) :
+        """
+        Add entries, return the number of new ones still in the store
+        """
+        added = []
+        for entry in entries :
+            if not isinstance(entry, Entry) :
+                entry = Entry.from_info(entry)
+            if self.add(entry) :
+                added.append(entry.key)
+        # les premières ajoutées peuvent avoir été retirées par les suivantes
+        with self._lock :
+            return sum(key in self._entries for key in added)
+
+    def truncate(self, size) :
+        """
+        Keep the first size entries
+        """
+        with self._lock :
+            while len(self._entries) > max(0, size) :
+                self._entries.popitem(last=True)
+
+    def clear(self) :
+        with self._lock :
+            self._entries.clear()
+
+# --------------------------------------------------------------------
+
+class PlaylistCursor :
+    """
+    Position in the entries of a flat playlist : batches are read on
+    demand, PagedList entries through yt-dlp's own paging, and what a
+    generator produced is kept, so that seek can go back
+    """
+
+    def __init__(self, entries, offset=0) :
+        if isinstance(entries, PagedList) :
+            # seules les pages demandées sont extraites
+            self._getslice = entries.getslice
+        else :
+            if not isinstance(entries, (list, tuple, LazyList)) :
+                entries = LazyList(entries or [])
+            self._getslice = lambda start, end : list(entries[start:end])
+        self._offset = 0
+        self._exhausted = False
+        self.seek(offset)
+
+    @property
+    def offset(self) :
+        return self._offset
+
+    @property
+    def exhausted(self) :
+        # la dernière lecture a atteint la fin de la playlist
+        return self._exhausted
+
+    def seek(self, offset) :
+        self._offset = max(0, int(offset))
+        self._exhausted = False
+
+    def next_batch(self, size) :
+        """
+        Entries from the current offset, at most size, and move past them
+        """
+        if size <= 0 :
+            return []
+        batch = self._getslice(self._offset, self._offset + size)
+        self._offset += len(batch)
+        self._exhausted = len(batch) < size
+        return batch
+
+# --------------------------------------------------------------------
@@ -6,15 +6,29 @@ log = logging.getLogger(__name__)
 log.debug(f'MODULE {__name__}')
 
 import argparse
+import pathlib
+import itertools
+import contextlib
+import collections
+import re
+import urllib.parse
+import concurrent.futures
 import lxml.html
+import lxml.etree
 import yt_dlp as youtube_dl
 from yt_dlp.utils import DownloadError, ExtractorError
 
 from .players import MediaPlayer
-from .web import WebService
+from .youtube import YoutubeDLPool, rerank_formats
+from .resolver import StreamResolver
+from .entries import Entry, EntryStore, PlaylistCursor
+from .m3u import M3UItem, M3UWriter, read_m3u
+from .web import WebService, SessionPool
+from .cache import PageCache
+from .exceptions import ServiceError
 from .parsers import CharsetHTMLParser
 
-__all__ = [ 'Playlist' ]
+__all__ = [ 'LastFmUrl', 'ChartRow', 'LastFmPage', 'LastFmChart', 'Playlist' ]
 
 # ------------------------------------------------------------------------------
 
@@ -54,26 +68,174 @@ class LastFmUrl :
         self._url = url
         return self._url
 
+    def page_url(self, num) :
+        """
+        Url of page num of the chart
+        """
+        split = urllib.parse.urlsplit(self.url)
+        query = [
+            (key, value) for key, value in urllib.parse.parse_qsl(split.query)
+            if key != 'page'
+        ]
+        if num > 1 :
+            query.append(('page', str(num)))
+        return split._replace(query=urllib.parse.urlencode(query)).geturl()
+
+    def page(self, user_agent=WebService.defaultUA, **kwargs) :
+        return LastFmPage(self.url, user_agent, **kwargs)
+
+# ------------------------------------------------------------------------------
+
+def _cell(name) :
+    # cellule 'chartlist-<name>' d'une ligne, parmi les autres classes
+    return f"td[contains(concat(' ', normalize-space(@class), ' '), ' chartlist-{name} ')]"
+
+class ChartRow :
+    """
+    One row of a Last.fm chartlist
+    """
+
+    __slots__ = ( 'artist', 'track', 'link', 'duration', 'listeners' )
+
+    # expressions compilées une fois, évaluées sur chaque ligne
+    xpath_rows = lxml.etree.XPath(f"//tr[{_cell('play')}]")
+    xpath_link = lxml.etree.XPath(f"{_cell('play')}/a/@href")
+    xpath_artist = lxml.etree.XPath(
+        f"string(({_cell('artist')}//a | {_cell('play')}/a/@data-artist-name)[1])"
+    )
+    xpath_track = lxml.etree.XPath(
+        f"string(({_cell('name')}//a | {_cell('play')}/a/@data-track-name)[1])"
+    )
+    xpath_duration = lxml.etree.XPath(f"string({_cell('duration')})")
+    xpath_listeners = lxml.etree.XPath(
+        f"string(({_cell('bar')}//*[contains(@class, 'chartlist-count-bar-value')] | {_cell('listeners')})[1])"
+    )
+
+    re_digits = re.compile(r'\D')
+
+    def __init__(self, artist=None, track=None, link=None, duration=None, listeners=None) :
+        self.artist = artist
+        self.track = track
+        self.link = link
+        self.duration = duration
+        self.listeners = listeners
+
+    @classmethod
+    def rows(cls, tree) :
+        return [ cls.from_element(row) for row in cls.xpath_rows(tree) ]
+
+    @classmethod
+    def from_element(cls, row) :
+        links = cls.xpath_link(row)
+        return cls(
+            artist=cls.xpath_artist(row).strip() or None,
+            track=cls.xpath_track(row).strip() or None,
+            link=str(links[0]) if links else None,
+            duration=cls.seconds(cls.xpath_duration(row)),
+            listeners=int(cls.re_digits.sub('', cls.xpath_listeners(row)) or 0) or None,
+        )
+
+    @staticmethod
+    def seconds(text) :
+        # '3:45', '1:02:03'
+        try :
+            return sum(
+                int(part) * 60 ** power
+                for power, part in enumerate(reversed(text.strip().split(':')))
+            )
+        except ValueError :
+            return None
+
+    @property
+    def title(self) :
+        return ' - '.join(filter(None, (self.artist, self.track))) or None
+
+    def ie_result(self) :
+        ie_result = { '_type' : 'url', 'url' : self.link }
+        if self.title is not None :
+            ie_result['title'] = self.title
+        if self.duration is not None :
+            ie_result['duration'] = self.duration
+        return ie_result
+
+    def __repr__(self) :
+        return f'ChartRow(artist={self.artist!r}, track={self.track!r}, link={self.link!r})'
+
 # ------------------------------------------------------------------------------
 
 class LastFmPage :
 
-    def __init__(self, url, user_agent) :
+    # sessions partagées : connexions conservées d'une page à l'autre
+    sessions = SessionPool()
+    # pages analysées récemment, par url finale
+    pages = PageCache(ttl=600)
+
+    xpath_play_links = "//td[@class='chartlist-play']/a/@href"
+
+    def __init__(self, url, user_agent, cache=None, stream=False, compact=False) :
         self.user_agent = user_agent
+        self.cache = cache
+        self.stream = stream
+        # compact : seules les lignes du chartlist sont conservées
+        self.compact = compact
         self._load(url)
 
+    def _usable(self, page) :
+        # une page lue en flux n'a pas gardé le texte, une page compacte ni l'arbre
+        if self.compact :
+            return page['rows'] is not None
+        if page['tree'] is None :
+            return False
+        return self.stream or page['data'] is not None
+
     def _load(self, url) :
-        ws = WebService()
-        ws.user_agent = self.user_agent
-        req = ws.get(url)
-        bindata = req.content
-        charset_parser = CharsetHTMLParser()
-        charset_parser.parse(bindata)
-        data = bindata.decode(charset_parser.charset)
-        self._page = {
+        page = self.pages.get(url)
+        if page is not None and self._usable(page) :
+            log.debug(f'cached page - {url}')
+            self._page = page
+            return
+
+        with self.sessions.checkout() as session :
+            ws = WebService(session, cache=self.cache)
+            if self.stream :
+                self._page = self._load_stream(ws, url)
+            else :
+                req = ws.get(url, headers={'User-Agent' : self.user_agent})
+                data = ws.decode(req)
+                self._page = {
+                    'url' : req.url,
+                    'data' : data,
+                    'tree' : lxml.html.fromstring(data),
+                    'rows' : None
+                }
+        if self.compact :
+            self._page = {
+                'url' : self._page['url'],
+                'data' : None,
+                'tree' : None,
+                'rows' : ChartRow.rows(self._page['tree'])
+            }
+        self.pages.store(url, self._page['url'], self._page)
+
+    def _load_stream(self, ws, url, chunk_size=64*1024) :
+        # arbre construit au fil du téléchargement, sans garder le texte brut
+        req = ws.get(url, stream=True, headers={'User-Agent' : self.user_agent})
+        try :
+            chunks = req.iter_content(chunk_size)
+            first = next(chunks, b'')
+            charset_parser = CharsetHTMLParser()
+            charset_parser.parse(first, req.headers.get('Content-Type'))
+            parser = lxml.html.HTMLParser(encoding=charset_parser.libxml2_charset)
+            for chunk in itertools.chain([first], chunks) :
+                parser.feed(chunk)
+            tree = parser.close()
+        finally :
+            req.close()
+        return {
             'url' : req.url,
-            'data' : data,
-            'tree' : lxml.html.fromstring(data)
+            'data' : None,
+            'tree' : tree,
+            'rows' : None
         }
 
     @property
@@ -84,6 +246,19 @@ class LastFmPage :
     def url(self, url) :
         self._load(url)
 
+    def rows(self) :
+        """
+        Chartlist rows, extracted once
+        """
+        if self._page['rows'] is None :
+            self._page['rows'] = ChartRow.rows(self.tree)
+        return self._page['rows']
+
+    def play_links(self) :
+        if self.tree is None :
+            return [ row.link for row in self.rows() if row.link ]
+        return self.tree.xpath(self.xpath_play_links)
+
     @property
     def data(self) :
         return self._page['data']
@@ -94,19 +269,84 @@ class LastFmPage :
 
 # ------------------------------------------------------------------------------
 
+class LastFmChart :
+    """
+    Tag, artist or track chart over several pages : pages ?page=N are
+    fetched concurrently, play links merged in page order without
+    duplicates, up to max_pages pages or max_tracks links
+    """
+
+    def __init__(self, url, user_agent=WebService.defaultUA, max_pages=10, max_tracks=None, max_workers=4, cache=None) :
+        self.url = url if isinstance(url, LastFmUrl) else LastFmUrl(url=str(url))
+        self.user_agent = user_agent
+        self.max_pages = max_pages
+        self.max_tracks = max_tracks
+        self.max_workers = max_workers
+        self.cache = cache
+
+    def _page_rows(self, num) :
+        try :
+            page = LastFmPage(self.url.page_url(num), self.user_agent, self.cache, compact=True)
+            return [ row for row in page.rows() if row.link ]
+        except ServiceError as e :
+            # page au delà de la dernière (404...)
+            log.debug(f'page {num} : {e}')
+            return []
+
+    def rows(self) :
+        rows = {}
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor :
+            # vagues de max_workers pages : arrêt à la première page vide
+            for first in range(1, self.max_pages + 1, self.max_workers) :
+                nums = range(first, min(first + self.max_workers, self.max_pages + 1))
+                for page_rows in executor.map(self._page_rows, nums) :
+                    if not page_rows :
+                        return self._limit(rows)
+                    for row in page_rows :
+                        rows.setdefault(row.link, row)
+                    if self.max_tracks is not None and len(rows) >= self.max_tracks :
+                        return self._limit(rows)
+        return self._limit(rows)
+
+    def _limit(self, rows) :
+        return list(itertools.islice(rows.values(), self.max_tracks))
+
+    def play_links(self) :
+        return [ row.link for row in self.rows() ]
+
+# ------------------------------------------------------------------------------
+
 class Playlist :
 
-    def __init__(self, url=None, batch=50, album=None) :
+    # instances YoutubeDL des workers de resolve_all
+    pool = YoutubeDLPool(maxsize=8)
+    ytdl_params = { 'verbose' : True }
+
+    # répertoire par défaut des fichiers m3u
+    m3u_directory = 'data'
+
+    def __init__(self, url=None, batch=50, album=None, resolver=None, prefetch=2, max_entries=10000) :
         # Instance
         self._infos = None
-        self._cache = []
+        self._cursor = None
+        self._cache = EntryStore(maxsize=max_entries)
         self._url = url
         self._batch = batch
         self._album = album
+        self._resolver = None
+        self.resolver = resolver
+
+        # entrées suivantes résolues pendant la lecture
+        self._prefetch = 0
+        self.prefetch = prefetch
+        self._queue = collections.deque()
+        self._executor = None
+
+        # urls déjà présentes dans chaque fichier m3u
+        self._m3u_urls = {}
 
         # YoutubeDL (yt_dlp)
-        self._ytdl = youtube_dl.YoutubeDL()
-        self._ytdl.params['verbose'] = True
+        self._ytdl = self._new_ytdl()
 
         # Mpv Player
         self._mpv = MediaPlayer(id='mpv')
@@ -116,6 +356,10 @@ class Playlist :
             self._update(url)
             self.extract_info()
 
+    @classmethod
+    def _new_ytdl(cls) :
+        return youtube_dl.YoutubeDL(dict(cls.ytdl_params))
+
     @property
     def url(self) :
         return self._url
@@ -131,8 +375,38 @@ class Playlist :
 
     @cache_size.setter
     def cache_size(self, size) :
-        resize = min(size, len(self._cache))
-        self._cache[:] = self._cache[:resize:]
+        self._cache.truncate(size)
+
+    @property
+    def max_entries(self) :
+        return self._cache.maxsize
+
+    @max_entries.setter
+    def max_entries(self, max_entries) :
+        # au delà, les entrées les plus anciennes sont retirées
+        self._cache.maxsize = max_entries
+
+    @property
+    def resolver(self) :
+        return self._resolver
+
+    @resolver.setter
+    def resolver(self, resolver) :
+        # True : StreamResolver qui résout avec les YoutubeDL du pool
+        if resolver is True :
+            resolver = StreamResolver(self._resolve_url)
+        if self._resolver is not None and self._resolver is not resolver :
+            self._resolver.close()
+        self._resolver = None if resolver is False else resolver
+
+    @property
+    def prefetch(self) :
+        return self._prefetch
+
+    @prefetch.setter
+    def prefetch(self, prefetch) :
+        # nombre d'entrées résolues d'avance, 0 : résolution à la demande
+        self._prefetch = max(0, int(prefetch))
 
     @property
     def batch(self) :
@@ -144,38 +418,70 @@ class Playlist :
 
     def _update(self, url) :
         self._url = url
+        self._cursor = None
         if self._album is None :
             self._infos = self._ytdl.extract_info(url, process=False)
         else :
+            # LastFmPage ou LastFmChart : titres et durées lus sur la page
             self._infos = {'_type' : 'playlist', 'entries' : []}
-            for url_song in self._album.tree.xpath("//td[@class='chartlist-play']/a/@href") :
-                self._infos['entries'].append({ '_type' : 'url', 'url' : url_song })
+            for row in self._album.rows() :
+                if row.link :
+                    self._infos['entries'].append(row.ie_result())
             
         #self._cache = []
     
+    @property
+    def cursor(self) :
+        """
+        Position in the playlist entries, for seek
+        """
+        if self._cursor is None and self._infos is not None :
+            self._cursor = PlaylistCursor(self._infos.get('entries'))
+        return self._cursor
+
     def extract_info(self) :
         if self._infos['_type'] == 'url' :
-            self._cache = []
-            self._cache.append(self._infos)
+            self._cache.clear()
+            self._cache.add(self._infos)
         else :
-            bunch = list(x for _,x in zip(range(self.batch), self._infos['entries']))
-            self._cache.extend(bunch)
+            # lot suivant : chaque appel avance dans la playlist
+            self._cache.extend(self.cursor.next_batch(self.batch))
+        self.cancel_prefetch()
         self._sinfos = iter(self._cache)
 
     def restart(self) :
+        self.cancel_prefetch()
         self._sinfos = iter(self._cache)
 
     def next_entry(self) :
         try :
-            ie_result = next(self._sinfos)
+            ie_result = next(self._sinfos).ie_result()
             log.info("ie_result=%r", ie_result)
             return ie_result
         except StopIteration :
             return {}
 
-    def info(self, ie_result) :
+    def info(self, ie_result, ytdl=None) :
+        url = ie_result.get('url')
+        if self._resolver is None or not url :
+            return self._info(ie_result, ytdl)
+        # urls signées suivies et rafraîchies par le resolver
+        try :
+            return self._resolver.get(url)
+        except ServiceError as err :
+            log.error("ServiceError: %s", err)
+        return {}
+
+    def _resolve_url(self, url) :
+        with self.pool.checkout(self.ytdl_params) as ytdl :
+            info_dict = self._info({ '_type' : 'url', 'url' : url }, ytdl)
+        if not info_dict :
+            raise ServiceError(f'url: {url} - not resolved')
+        return info_dict
+
+    def _info(self, ie_result, ytdl=None) :
         try :
-            info_dict = self._ytdl.process_ie_result(ie_result, download=False)
+            info_dict = (ytdl or self._ytdl).process_ie_result(ie_result, download=False)
             log.info("info_dict: title=%s url=%s", info_dict['title'], info_dict['webpage_url'])
             return info_dict
         except ExtractorError as err :
@@ -184,10 +490,89 @@ class Playlist :
             log.error("DownloadError: %s", err)
         return {}
 
+    def resolve_all(self, entries=None, max_workers=4, resolve=None) :
+        """
+        Resolve entries (default : the cache) concurrently ; results are
+        yielded in the original order, as soon as every previous entry
+        is resolved. resolve(ie_result, ytdl) gets ytdl as a callable
+        returning the worker's own YoutubeDL, checked out of the pool on
+        the first call only
+        """
+        resolve = resolve or (lambda ie_result, ytdl : self.info(ie_result, ytdl()))
+
+        def worker(ie_result) :
+            with self._lazy_ytdl() as ytdl :
+                return resolve(ie_result, ytdl)
+
+        entries = [
+            entry.ie_result() if isinstance(entry, Entry) else entry
+            for entry in (self._cache if entries is None else entries)
+        ]
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor :
+            yield from executor.map(worker, entries)
+
+    @contextlib.contextmanager
+    def _lazy_ytdl(self) :
+        # YoutubeDL n'est pas partageable entre threads : un par worker,
+        # pris dans le pool seulement s'il sert
+        with contextlib.ExitStack() as stack :
+            checked_out = []
+
+            def ytdl() :
+                if not checked_out :
+                    checked_out.append(stack.enter_context(self.pool.checkout(self.ytdl_params)))
+                return checked_out[0]
+
+            yield ytdl
+
+    def _prefetch_info(self, ie_result) :
+        with self.pool.checkout(self.ytdl_params) as ytdl :
+            return self.info(ie_result, ytdl)
+
+    def _fill_queue(self) :
+        # file bornée : les entrées suivantes en cours de résolution
+        while len(self._queue) < self.prefetch :
+            ie_result = self.next_entry()
+            if not ie_result :
+                break
+            if self._executor is None :
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    self.prefetch, thread_name_prefix='Playlist'
+                )
+            future = self._executor.submit(self._prefetch_info, ie_result)
+            self._queue.append((ie_result, future))
+
+    def cancel_prefetch(self) :
+        while self._queue :
+            _, future = self._queue.popleft()
+            future.cancel()
+
+    def skip(self, count=1) :
+        """
+        Skip the next count entries, cancelling their resolution
+        """
+        for _ in range(count) :
+            if self._queue :
+                _, future = self._queue.popleft()
+                future.cancel()
+            elif not self.next_entry() :
+                break
+        self._fill_queue()
+
     def info_next(self) :
+        """
+        Resolved info of the next entry, the following ones being
+        resolved in the background
+        """
         try :
-            ie_result = self.next_entry()
-            return self.info(ie_result)
+            if not self.prefetch :
+                return self.info(self.next_entry())
+            self._fill_queue()
+            if not self._queue :
+                return {}
+            _, future = self._queue.popleft()
+            self._fill_queue()
+            return future.result()
         except :
             pass
 
@@ -200,51 +585,130 @@ class Playlist :
             pass
 
     def play(self, ie_result, height=1080) :
+        try :
+            self._play_info(self.info(ie_result), height)
+        except :
+            pass
+
+    @staticmethod
+    def _mpv_media(info_dict) :
+        """
+        Stream url and mpv options of a resolved info dict, the page url
+        when the streams are unknown
+        """
+        formats = info_dict.get('requested_formats') or [ info_dict ]
+        urls = [ fmt.get('url') for fmt in formats ]
+        if not all(urls) :
+            return info_dict['webpage_url'], []
+        # flux déjà résolus : mpv ne repasse pas par yt-dlp
+        options = [ 'ytdl=no' ]
+        options.extend(f'audio-file={url}' for url in urls[1:])
+        headers = formats[0].get('http_headers') or {}
+        for header, option in ( ('User-Agent', 'user-agent'), ('Referer', 'referrer') ) :
+            if headers.get(header) :
+                options.append(f'{option}={headers[header]}')
+        return urls[0], options
+
+    def _play_info(self, info_dict, height=1080) :
         #self._mpv.options.clear()
         #self._mpv.add_options(f'--ytdl-format=bestvideo[height<={height}]+bestaudio/best[height<={height}]')        
         self._mpv.mpv_options.set_raw_options('format-sort', f'res:{height},+tbr')
+        # sélection à la hauteur demandée, sur les formats déjà extraits
+        params = dict(self.ytdl_params, format_sort=[ f'res:{height}', '+tbr' ])
+        with self.pool.checkout(params) as ytdl :
+            info_dict = rerank_formats(ytdl, info_dict)
+        uri, options = self._mpv_media(info_dict)
+        self._mpv.add_options(*options)
         try :
-            info_dict = self.info(ie_result)
-            p = self._mpv.play(info_dict['title'], info_dict['webpage_url'])
-            p.wait()
-        except :
-            pass
+            p = self._mpv.play(info_dict['title'], uri)
+        finally :
+            self._mpv.remove_options(*options)
+        p.wait()
 
     def play_next(self, height=1080) :
+        # l'entrée suivante est déjà résolue pendant la lecture de celle-ci
         try :
-            ie_result = self.next_entry()
-            self.play(ie_result, height)
+            self._play_info(self.info_next(), height)
         except :
             pass
 
-    def save_m3u(self, name='playlist') :
-        with open(f'data/{name}.m3u', 'w', encoding='utf8') as fd :
-            fd.write(f"#EXTM3U\n")
-            for ie_result in self._cache :
-                try :
-                    url = ie_result.get('url')
-                    title = ie_result.get('title')
-                    duration = int(ie_result.get('duration',-1))
-                    #thumbnails = [ie_result.get('thumbnail')] if isinstance(ie_result.get('thumbnail'), str) else ie_result.get('thumbnails')
-                    if title is None :
-                        info_dict = self.info(ie_result)
-                        title = info_dict['title']
-                        duration = int(info_dict.get('duration',-1))
-                        #thumbnails = [info_dict.get('thumbnail')] if isinstance(info_dict.get('thumbnail'), str) else info_dict.get('thumbnails')
-                    log.debug(f"Title: {title} - Url: {url} - Duration: {duration}")
-                    fd.write(f"#EXTINF:{duration},{title}\n")
-                    fd.write(f"{url}\n")
-                except :
-                    pass
-
-    def play_m3u(self, name='playlist', height=1080, shuffle=False) :
+    def _m3u_entry(self, ie_result, ytdl=None) :
+        # ytdl : YoutubeDL à la demande, voir resolve_all
+        try :
+            url = ie_result.get('url')
+            title = ie_result.get('title')
+            duration = int(ie_result.get('duration') or -1)
+            if title is None :
+                info_dict = self.info(ie_result, ytdl() if ytdl else None)
+                title = info_dict['title']
+                duration = int(info_dict.get('duration') or -1)
+            return url, title, duration
+        except Exception as e :
+            log.debug(f"m3u entry skipped : {e!r}")
+            return None
+
+    def m3u_path(self, name='playlist', directory=None) :
+        return pathlib.Path(directory or self.m3u_directory) / f'{name}.m3u'
+
+    def save_m3u(self, name='playlist', max_workers=4, directory=None, append=False) :
+        """
+        Write the cache to an m3u file ; with append=True, only the
+        entries not yet in the file are added after the existing ones
+        """
+        path = self.m3u_path(name, directory)
+        if append :
+            written = self._written_urls(path)
+            entries = [ entry for entry in self._cache if entry.url not in written ]
+        else :
+            written = self._m3u_urls[path.resolve()] = set()
+            entries = list(self._cache)
+        m3u_entries = self.resolve_all(entries, max_workers=max_workers, resolve=self._m3u_entry)
+        with M3UWriter(path, append) as writer :
+            # résolution parallèle, écriture dans l'ordre
+            for entry, m3u_entry in zip(entries, m3u_entries) :
+                if m3u_entry is None :
+                    continue
+                url, title, duration = m3u_entry
+                log.debug(f"Title: {title} - Url: {url} - Duration: {duration}")
+                # attributs lus par load_m3u conservés
+                writer.write(M3UItem(url, title, None if duration < 0 else duration, dict(entry.attrs or {})))
+                written.add(entry.url)
+        return writer.count
+
+    def _written_urls(self, path) :
+        # fichier lu une seule fois, puis complété à chaque écriture
+        key = path.resolve()
+        if key not in self._m3u_urls :
+            self._m3u_urls[key] = { item.url for item in read_m3u(path) } if path.exists() else set()
+        return self._m3u_urls[key]
+
+    def load_m3u(self, name='playlist', directory=None, max_entries=None) :
+        """
+        Add the entries of an m3u file to the cache, return the number
+        of new ones kept ; max_entries overrides the cache bound
+        """
+        if max_entries is not None :
+            self.max_entries = max_entries
+        items = read_m3u(self.m3u_path(name, directory))
+        evicted = self._cache.evicted
+        added = self._cache.extend(item.to_entry() for item in items)
+        evicted = self._cache.evicted - evicted
+        if evicted :
+            log.warning(
+                f'load_m3u : {evicted} entries dropped beyond'
+                f' max_entries={self.max_entries}, see load_m3u(max_entries=...)'
+            )
+        self.restart()
+        return added
+
+    def play_m3u(self, name='playlist', height=1080, shuffle=False, directory=None) :
         #self._mpv.options.clear()
         #self._mpv.add_options(f'--ytdl-format=bestvideo[height<={height}]+bestaudio/best[height<={height}]')
         self._mpv.mpv_options.set_raw_options('format-sort', f'res:{height},+tbr')
         if shuffle :
             # self._mpv.add_options(f'--shuffle')
             self._mpv.add_options(f'shuffle')
-        p = self._mpv.play('', f'data/{name}.m3u')
+        p = self._mpv.play('', str(self.m3u_path(name, directory)))
         p.wait()
 
     def play_cache(self, height=1080, shuffle=False) :
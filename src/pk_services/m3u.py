@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+# logging
+import logging
+log = logging.getLogger(__name__)
+log.debug('MODULE {}'.format(__name__))
+
+import re
+import pathlib
+
+from .entries import Entry
+
+__all__ = [ 'M3UItem', 'M3UWriter', 'read_m3u', 'write_m3u' ]
+
+# --------------------------------------------------------------------
+
+# #EXTINF:<durée> attr="valeur" ...,<titre>
+_re_extinf = re.compile(r'#EXTINF:\s*(-?\d+(?:\.\d+)?)((?:\s+[\w-]+="[^"]*")*)\s*,(.*)')
+_re_attribute = re.compile(r'([\w-]+)="([^"]*)"')
+
+class M3UItem :
+    """
+    One playlist item : url, #EXTINF duration and title, and extended
+    attributes (tvg-logo, group-title...)
+    """
+
+    __slots__ = ( 'url', 'title', 'duration', 'attrs' )
+
+    def __init__(self, url, title=None, duration=None, attrs=None) :
+        self.url = url
+        self.title = title
+        self.duration = duration
+        self.attrs = attrs or {}
+
+    @classmethod
+    def from_entry(cls, entry) :
+        return cls(entry.url, entry.title, entry.duration, dict(entry.attrs or {}))
+
+    def to_entry(self) :
+        return Entry(self.url, title=self.title, duration=self.duration, attrs=dict(self.attrs) or None)
+
+    @property
+    def logo(self) :
+        return self.attrs.get('tvg-logo')
+
+    @property
+    def group(self) :
+        return self.attrs.get('group-title')
+
+    def extinf(self) :
+        duration = -1 if self.duration is None else int(self.duration)
+        # pas de guillemet dans la valeur d'un attribut
+        attrs = ''.join(
+            f' {key}="{self._clean(value).replace(chr(34), chr(39))}"'
+            for key, value in self.attrs.items()
+            if value is not None
+        )
+        return f'#EXTINF:{duration}{attrs},{self._clean(self.title or "")}'
+
+    @staticmethod
+    def _clean(value) :
+        # une entrée par ligne
+        return str(value).replace('\n', ' ').replace('\r', ' ')
+
+    def __eq__(self, other) :
+        if not isinstance(other, M3UItem) :
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self) :
+        return f'M3UItem(url={self.url!r}, title={self.title!r}, duration={self.duration!r})'
+
+# --------------------------------------------------------------------
+
+def _parse_extinf(line) :
+    match = _re_extinf.match(line)
+    if match is None :
+        # #EXTINF non conforme : durée seule ou titre sans virgule
+        duration, _, title = line[len('#EXTINF:'):].partition(',')
+        attrs = {}
+    else :
+        duration, attributes, title = match.groups()
+        attrs = dict(_re_attribute.findall(attributes))
+    try :
+        duration = int(float(duration))
+    except ValueError :
+        duration = -1
+    return (None if duration < 0 else duration), title.strip() or None, attrs
+
+def read_m3u(path) :
+    """
+    Stream the items of an M3U / M3U8 file, line by line
+    """
+    with open(path, 'r', encoding='utf-8-sig', errors='replace') as fd :
+        title = duration = None
+        attrs = {}
+        for line in fd :
+            line = line.strip()
+            if not line or line == '#EXTM3U' :
+                continue
+            if line.startswith('#EXTINF:') :
+                duration, title, attrs = _parse_extinf(line)
+            elif line.startswith('#EXTGRP:') :
+                attrs.setdefault('group-title', line[len('#EXTGRP:'):].strip())
+            elif line.startswith('#') :
+                # autres directives et commentaires
+                continue
+            else :
+                yield M3UItem(line, title, duration, attrs)
+                title = duration = None
+                attrs = {}
+
+# --------------------------------------------------------------------
+
+class M3UWriter :
+    """
+    Buffered M3U / M3U8 writer ; in append mode, items are added at the
+    end of an existing file, which is not rewritten
+    """
+
+    def __init__(self, path, append=False) :
+        self.path = pathlib.Path(path)
+        self.append = append
+        self.count = 0
+        self._fd = None
+
+    def __enter__(self) :
+        return self.open()
+
+    def __exit__(self, *exc) :
+        self.close()
+
+    def open(self) :
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        header = not (self.append and self.path.exists() and self.path.stat().st_size)
+        self._fd = open(self.path, 'a' if self.append else 'w', encoding='utf-8', newline='\n')
+        if header :
+            self._fd.write('#EXTM3U\n')
+        return self
+
+    def write(self, item) :
+        """
+        Write an M3UItem or an Entry
+        """
+        if not isinstance(item, M3UItem) :
+            item = M3UItem.from_entry(item)
+        self._fd.write(f'{item.extinf()}\n{item.url}\n')
+        self.count += 1
+
+    def writelines(self, items) :
+        for item in items :
+            self.write(item)
+
+    def flush(self) :
+        self._fd.flush()
+
+    def close(self) :
+        if self._fd is not None :
+            self._fd.close()
+            self._fd = None
+
+def write_m3u(path, items, append=False) :
+    """
+    Write items (M3UItem or Entry) to path, return their number
+    """
+    with M3UWriter(path, append) as writer :
+        writer.writelines(items)
+    return writer.count
+
+# --------------------------------------------------------------------
@@ -5,25 +5,39 @@ import logging
 log = logging.getLogger(__name__)
 log.debug('MODULE {}'.format(__name__))
 
+import re
 import json
+import codecs
 import pathlib
+import functools
 import urllib.parse
 import html.parser
 import lxml.etree
 
-__all__ = [ 'DomainParserConfig', 'CharsetHTMLParser', 'ImageLinkHTMLParser', 'MediaHMTLParser' ]
+from .core import LRUCache
+from .domains import DomainIndex
+
+__all__ = [ 'DomainParserConfig', 'CharsetHTMLParser', 'ImageLinkHTMLParser', 'MediaHMTLParser', 'libxml2_encoding' ]
+
+# espace de noms des fonctions XPath étendues (fn:urljoin)
+FUNCTIONS_NS = 'http://mydomain.org/functions'
 
 # --------------------------------------------------------------------
 
 class DomainParserConfig :
 
-    def __init__(self) :
+    def __init__(self, public_suffixes=None, cache_size=4096) :
         self._data = {
             'default' : [
                 "//a[descendant::img]/descendant::img/@src",
                 "//a[descendant::img]/@href"
             ],
         }
+        self._xpaths = {}
+        self._compiled = {}
+        self._public_suffixes = public_suffixes
+        self._index = DomainIndex()
+        self._found = LRUCache(cache_size)
 
     def __str__(self) :
         return self.toJSON(indent=2)
@@ -58,27 +72,89 @@ class DomainParserConfig :
 
     def update(self, dico) :
         self._data.update(dico)
+        self._compiled.clear()
+        self._reindex()
+
+    def add_domain(self, domain, xpath_img, xpath_link, xpath_next=None) :
+        # xpath_next : liens vers la page suivante, pour le crawler
+        if xpath_next is None :
+            self._data[domain] = (xpath_img, xpath_link)
+        else :
+            self._data[domain] = (xpath_img, xpath_link, xpath_next)
+        self._compiled.pop(domain, None)
+        self._reindex()
+
+    def _reindex(self) :
+        self._index = DomainIndex(key for key in self._data if key != 'default')
+        self._found.clear()
+
+    @property
+    def public_suffixes(self) :
+        return self._public_suffixes
 
-    def add_domain(self, domain, xpath_img, xpath_link) :
-        self._data[domain] = (xpath_img, xpath_link)
+    @public_suffixes.setter
+    def public_suffixes(self, public_suffixes) :
+        # PublicSuffixList : une règle posée sur un suffixe public est ignorée
+        self._public_suffixes = public_suffixes
+        self._found.clear()
 
     def get_domain(self, domain) :
         return self._data.get(domain, self._data.get('default'))
 
+    def find_domain(self, url) :
+        """
+        Most specific configured domain for the host of url, or 'default'
+        """
+        netloc = urllib.parse.urlsplit(url).netloc
+        domain = self._found.get(netloc)
+        if domain is None :
+            host = netloc.rpartition('@')[2].partition(':')[0]
+            domain = self._index.find(host)
+            if ( domain is not None and self._public_suffixes is not None
+                 and self._public_suffixes.is_public_suffix(domain) ) :
+                domain = None
+            domain = domain or 'default'
+            self._found.set(netloc, domain)
+        return domain
+
     def find_url(self, url) :
-        url_split = urllib.parse.urlsplit(url)
-        domain_items = url_split.netloc.split('.')
-        domain = '.'.join(domain_items[-2:])
-        return self.get_domain(domain)
+        return self.get_domain(self.find_domain(url))
+
+    def xpath(self, expression) :
+        """
+        Compiled lxml.etree.XPath for an expression, compiled once
+        """
+        try :
+            return self._xpaths[expression]
+        except KeyError :
+            compiled = lxml.etree.XPath(expression, namespaces={'fn' : FUNCTIONS_NS})
+            self._xpaths[expression] = compiled
+            return compiled
+
+    def get_compiled(self, domain) :
+        if domain not in self._data :
+            domain = 'default'
+        try :
+            return self._compiled[domain]
+        except KeyError :
+            compiled = tuple(self.xpath(motif) for motif in self._data[domain])
+            self._compiled[domain] = compiled
+            return compiled
+
+    def find_compiled(self, url) :
+        return self.get_compiled(self.find_domain(url))
 
 # --------------------------------------------------------------------
 
 class ImageLinkHTMLParser :
 
-    def __init__(self) :
+    def __init__(self, config=None, paired=False) :
         self._images_links = {}
-        self._domain_parser_config = DomainParserConfig()
-        self._ns = lxml.etree.FunctionNamespace('http://mydomain.org/functions')
+        self._next_pages = []
+        self._generation = 0
+        self._domain_parser_config = config or DomainParserConfig()
+        self._paired = paired
+        self._ns = lxml.etree.FunctionNamespace(FUNCTIONS_NS)
         self._ns.prefix = 'fn'
         self._ns['urljoin'] = self.urljoin
 
@@ -86,6 +162,20 @@ class ImageLinkHTMLParser :
     def config(self) :
         return self._domain_parser_config
 
+    @property
+    def generation(self) :
+        # incrémenté à chaque modification du résultat
+        return self._generation
+
+    @property
+    def paired(self) :
+        return self._paired
+
+    @paired.setter
+    def paired(self, paired) :
+        # paired : chaque image est associée au lien <a> qui l'englobe
+        self._paired = bool(paired)
+
     @property
     def images(self) :
         return list(self.images_links.keys())
@@ -102,33 +192,165 @@ class ImageLinkHTMLParser :
             il = {}
         return il
 
+    @property
+    def next_pages(self) :
+        # liens 'page suivante' de la dernière page, si la règle en définit
+        return self._next_pages
+
     def urljoin(self, context, nodes, baseurl) : 
             return [f"{urllib.parse.urljoin(baseurl, pathlib.Path(n).stem)}" for n in nodes]
 
     def parse(self, data, url) :
         self._images_links = {}
-        motif_image, motif_link = self._domain_parser_config.find_url(url)
-        self.add_parse(data, motif_image, motif_link)
+        self._next_pages = []
+        self._generation += 1
+        motifs = self._domain_parser_config.find_compiled(url)
+        tree = self.add_parse(data, *motifs[:2])
+        if tree is not None and len(motifs) > 2 :
+            self._next_pages = list(map(str, motifs[2](tree)))
 
     def add_parse(self, data, motif_image, motif_link) :
+        if isinstance(motif_image, str) :
+            motif_image = self._domain_parser_config.xpath(motif_image)
+        if isinstance(motif_link, str) :
+            motif_link = self._domain_parser_config.xpath(motif_link)
+
         tree = lxml.etree.HTML(data)
-        self._images_links.update(zip(
-            tree.xpath(motif_image),
-            tree.xpath(motif_link)
-        ))
-        log.debug(f"add_parse: {motif_image} / {motif_link} : {len(self.images_links)}")
-        
+        self._generation += 1
+        if tree is None :
+            # document vide : rien à extraire
+            log.debug('add_parse: empty document')
+            return None
+        if self.paired :
+            self._images_links.update(self.pairs(tree, motif_image))
+        else :
+            self._images_links.update(zip(
+                map(str, motif_image(tree)),
+                map(str, motif_link(tree))
+            ))
+        log.debug(f"add_parse: {motif_image.path} / {motif_link.path} : {len(self.images_links)}")
+        return tree
+
+    def stream(self, chunks, encoding=None) :
+        """
+        Incremental parse of an iterable of byte chunks, yield (image, link)
+        as each <img> inside an <a href> closes. Structural pairing only :
+        the domain XPath rules need the full tree and are not applied.
+        Closed elements are discarded so that memory stays bounded.
+        """
+        self._images_links = {}
+        self._generation += 1
+        parser = lxml.etree.HTMLPullParser(events=('start', 'end'), encoding=libxml2_encoding(encoding))
+        anchors = []
+        for chunk in chunks :
+            parser.feed(chunk)
+            yield from self._stream_events(parser, anchors)
+        parser.close()
+        yield from self._stream_events(parser, anchors)
+        log.debug(f"stream: {len(self.images_links)}")
+
+    def _stream_events(self, parser, anchors) :
+        for event, element in parser.read_events() :
+            if event == 'start' :
+                if element.tag == 'a' :
+                    anchors.append(element.get('href'))
+                continue
+
+            if element.tag == 'a' and anchors :
+                anchors.pop()
+            elif element.tag == 'img' and anchors and anchors[-1] is not None :
+                image = element.get('src')
+                if image is not None :
+                    self._images_links[image] = anchors[-1]
+                    self._generation += 1
+                    yield image, anchors[-1]
+
+            # élément fermé : libérer le sous-arbre et les frères précédents
+            element.clear()
+            parent = element.getparent()
+            if parent is not None :
+                while element.getprevious() is not None :
+                    del parent[0]
+
+    @staticmethod
+    def pairs(tree, motif_image) :
+        """
+        Single pass : yield (image, link) with the link of the enclosing <a>
+        """
+        for image in motif_image(tree) :
+            if isinstance(image, str) :
+                element = getattr(image, 'getparent', lambda : None)()
+            else :
+                element, image = image, image.get('src')
+            if element is None or image is None :
+                continue
+            anchor = next(element.iterancestors('a'), None)
+            if anchor is None or anchor.get('href') is None :
+                continue
+            yield str(image), anchor.get('href')
+
 
 # --------------------------------------------------------------------
 
-class CharsetHTMLParser(html.parser.HTMLParser) :
+# noms de codecs Python sans équivalent direct pour libxml2
+_libxml2_aliases = { 'utf-8-sig' : 'utf-8' }
+
+@functools.lru_cache(maxsize=64)
+def libxml2_encoding(charset) :
+    """
+    Name libxml2 accepts for a Python codec name, None when it has
+    none : libxml2 then sniffs the encoding itself
+    """
+    if charset is None :
+        return None
+    charset = _libxml2_aliases.get(charset, charset)
+    # euc_jp -> EUC-JP
+    for name in ( charset, charset.replace('_', '-').upper() ) :
+        try :
+            lxml.etree.HTMLPullParser(encoding=name)
+        except LookupError :
+            continue
+        return name
+    log.debug(f'charset unknown to libxml2 - {charset}')
+    return None
+
+class CharsetHTMLParser :
+    """
+    Charset detection : BOM, Content-Type header, then <meta> tags
+    in the first prefix_size bytes of the document only
+    """
+
+    prefix_size = 4096
+    re_header = re.compile(r'charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+    re_meta = re.compile(rb'<meta\s[^>]*?charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+    boms = (
+        (codecs.BOM_UTF8, 'utf-8-sig'),
+        (codecs.BOM_UTF16_LE, 'utf-16'),
+        (codecs.BOM_UTF16_BE, 'utf-16'),
+    )
 
-    def parse(self, data) :
+    def __init__(self) :
+        self._content = []
+
+    def parse(self, data, content_type=None) :
         self._content = []
-        for line in data.splitlines() :
-            self.feed(line.decode('utf-8'))
-            if len(self._content) > 0 :
+        for charset in self._candidates(data, content_type) :
+            try :
+                self._content.append(codecs.lookup(charset).name)
                 break
+            except LookupError :
+                log.debug(f'unknown charset - {charset}')
+
+    def _candidates(self, data, content_type) :
+        for bom, charset in self.boms :
+            if data.startswith(bom) :
+                yield charset
+        if content_type :
+            match = self.re_header.search(content_type)
+            if match :
+                yield match.group(1)
+        for match in self.re_meta.finditer(data[:self.prefix_size]) :
+            yield match.group(1).decode('ascii')
 
     @property
     def charset(self) :
@@ -137,13 +359,9 @@ class CharsetHTMLParser(html.parser.HTMLParser) :
         except IndexError :
             return 'utf-8'
 
-    def handle_starttag(self, tag, attrs) :
-        attributes = dict(attrs)
-        if ( tag == 'meta' and 'http-equiv' in attributes
-             and 'content' in attributes ) :
-            if 'charset' in attributes['content'] :
-                self._content.append(attributes['content'].split('=').pop())
-            
+    @property
+    def libxml2_charset(self) :
+        return libxml2_encoding(self.charset)
 
 # --------------------------------------------------------------------
 
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+# logging
+import logging
+log = logging.getLogger(__name__)
+log.debug('MODULE {}'.format(__name__))
+
+import time
+import heapq
+import threading
+import collections
+import concurrent.futures
+
+from .cache import info_expiry
+from .exceptions import ServiceError
+
+__all__ = [ 'StreamResolver' ]
+
+# --------------------------------------------------------------------
+
+class StreamResolver :
+    """
+    Resolved info dicts by key, with the expiry of their signed stream
+    urls : get returns the last resolution, and a background thread
+    resolves again the entries about to expire, so that only a missing
+    or already expired entry is resolved on the caller's thread ;
+    entries not read for idle_ttl seconds are dropped instead of being
+    refreshed, and at most maxsize entries are kept
+    """
+
+    def __init__(self, resolve, margin=600, stream_ttl=3600, min_interval=60, max_workers=2, idle_ttl=1800, maxsize=1024) :
+        # resolve(key) -> info dict, exception si échec
+        self._resolve = resolve
+        self.margin = margin
+        # urls sans expiration connue
+        self.stream_ttl = stream_ttl
+        # délai minimal entre deux rafraîchissements d'une entrée
+        self.min_interval = min_interval
+        self.max_workers = max_workers
+        self.idle_ttl = idle_ttl
+        self.maxsize = maxsize
+        # entrées par ordre de dernière lecture
+        self._entries = collections.OrderedDict()
+        self._accessed = {}
+        self._due = []
+        self._refreshing = set()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = None
+        self._closed = False
+        self.refreshed = 0
+
+    def __len__(self) :
+        return len(self._entries)
+
+    def __contains__(self, key) :
+        return key in self._entries
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *exc) :
+        self.close()
+
+    def expires(self, info) :
+        expiry = info_expiry(info)
+        return time.time() + self.stream_ttl if expiry is None else expiry
+
+    def expiry(self, key) :
+        with self._cond :
+            entry = self._entries.get(key)
+        return None if entry is None else entry[1]
+
+    def add(self, key, info) :
+        """
+        Record a resolved info dict and schedule its refresh
+        """
+        expires = self.expires(info)
+        due = max(expires - self.margin, time.time() + self.min_interval)
+        with self._cond :
+            if self._closed :
+                raise RuntimeError('StreamResolver closed')
+            self._entries[key] = (info, expires, due)
+            self._accessed.setdefault(key, time.time())
+            while len(self._entries) > self.maxsize :
+                # la moins récemment lue
+                self._drop(next(iter(self._entries)))
+            heapq.heappush(self._due, (due, key))
+            self._start()
+            self._cond.notify()
+        return info
+
+    def discard(self, key) :
+        with self._cond :
+            # l'entrée du tas est ignorée au réveil
+            self._drop(key)
+
+    def _drop(self, key) :
+        self._entries.pop(key, None)
+        self._accessed.pop(key, None)
+
+    def get(self, key, default=None) :
+        """
+        Info dict of key, default is recorded when key is unknown ;
+        resolved on the spot only if missing or already expired
+        """
+        with self._cond :
+            entry = self._entries.get(key)
+            if entry is not None :
+                self._entries.move_to_end(key)
+                self._accessed[key] = time.time()
+        if entry is None :
+            if default is None :
+                return self.add(key, self._resolve(key))
+            info, expires = default, self.expires(default)
+            if time.time() < expires :
+                return self.add(key, default)
+        else :
+            info, expires, _ = entry
+            if time.time() < expires :
+                return info
+        log.debug(f'expired - {key}')
+        try :
+            return self.add(key, self._resolve(key))
+        except (Exception, ServiceError) as e :
+            log.error(f'refresh failed - {key} : {e}')
+            return info
+
+    def refresh(self, key) :
+        """
+        Resolve key again in the background
+        """
+        with self._cond :
+            if key in self._refreshing or self._closed :
+                return
+            self._refreshing.add(key)
+            if self._executor is None :
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix='StreamResolver'
+                )
+            self._executor.submit(self._refresh, key)
+
+    def _refresh(self, key) :
+        try :
+            info = self._resolve(key)
+            with self._cond :
+                # entrée retirée entre temps
+                known = key in self._entries and not self._closed
+            if known :
+                self.add(key, info)
+                self.refreshed += 1
+                log.debug(f'refreshed - {key}')
+        except (Exception, ServiceError) as e :
+            log.error(f'refresh failed - {key} : {e}')
+            self._retry(key)
+        finally :
+            with self._cond :
+                self._refreshing.discard(key)
+
+    def _retry(self, key) :
+        # nouvel essai tant que les urls connues restent valides
+        due = time.time() + self.min_interval
+        with self._cond :
+            entry = self._entries.get(key)
+            if entry is None or self._closed or due >= entry[1] :
+                return
+            self._entries[key] = (entry[0], entry[1], due)
+            heapq.heappush(self._due, (due, key))
+            self._cond.notify()
+
+    def _start(self) :
+        if self._thread is None :
+            self._thread = threading.Thread(
+                target=self._run, name='StreamResolver', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) :
+        with self._cond :
+            while not self._closed :
+                if not self._due :
+                    self._cond.wait()
+                    continue
+                due, key = self._due[0]
+                delay = due - time.time()
+                if delay > 0 :
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._due)
+                entry = self._entries.get(key)
+                # échéance périmée : l'entrée a été remplacée ou retirée
+                if entry is None or entry[2] != due :
+                    continue
+                if time.time() - self._accessed.get(key, 0) > self.idle_ttl :
+                    # plus lue depuis idle_ttl : retirée, pas rafraîchie
+                    log.debug(f'idle - {key}')
+                    self._drop(key)
+                    continue
+                self._cond.release()
+                try :
+                    self.refresh(key)
+                finally :
+                    self._cond.acquire()
+
+    def close(self) :
+        with self._cond :
+            self._closed = True
+            self._cond.notify_all()
+            executor, self._executor = self._executor, None
+        if executor is not None :
+            executor.shutdown(wait=False, cancel_futures=True)
+
+# --------------------------------------------------------------------
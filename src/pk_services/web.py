@@ -8,27 +8,183 @@ log.debug('MODULE {}'.format(__name__))
 import os
 import re
 import codecs
+import functools
+import itertools
+import collections
+import concurrent.futures
 
 import requests
+import requests.adapters
 import urllib.parse
+import urllib3.util
+import urllib3.exceptions
 
-from .core import Service
+from .core import Service, ObjectPool
 from .exceptions import ServiceError
 from .parsers import CharsetHTMLParser, ImageLinkHTMLParser
 
-__all__ = [ 'WebService', 'WebRequest', 'GrabService' ]
+__all__ = [ 'WebService', 'WebRequest', 'GrabService', 'SessionPool', 'urljoin_many' ]
+
+# --------------------------------------------------------------------
+
+# jointures mémorisées : les mêmes liens reviennent d'une page à l'autre
+_urljoin = functools.lru_cache(maxsize=64*1024)(urllib.parse.urljoin)
+
+# ce que urljoin normaliserait : espaces, paramètres, '?' ou '#' vides
+_re_not_plain = re.compile(r'[\x00-\x20\x7f;\\]|[?#]$|\?#')
+# chemins : segments '.' / '..' et, pour les chemins relatifs, '//' et schéma
+_re_dot_segment = re.compile(r'/\.')
+_re_not_plain_relative = re.compile(r'^\.|/\.|//|^[^/?#]*:')
+_re_absolute = re.compile(r'https?://[^/?#@]')
+
+def urljoin_many(base, urls) :
+    """
+    Absolutize a batch of urls against base : the base is parsed once,
+    plain absolute and relative urls are joined by concatenation,
+    anything urljoin would normalize goes through urllib.parse.urljoin
+    """
+    split = urllib.parse.urlsplit(base)
+    plain_base = (
+        split.scheme in ('http', 'https') and split.netloc
+        and not _re_not_plain.search(base)
+        and not _re_not_plain_relative.search(split.path)
+    )
+    root = f'{split.scheme}://{split.netloc}'
+    directory = root + (split.path[:split.path.rfind('/')+1] or '/')
+
+    joined = []
+    for url in urls :
+        if not plain_base or not url or _re_not_plain.search(url) :
+            joined.append(_urljoin(base, url))
+        elif _re_absolute.match(url) :
+            joined.append(url)
+        elif url[0] == '/' :
+            if url[:2] == '//' or _re_dot_segment.search(url) :
+                joined.append(_urljoin(base, url))
+            else :
+                joined.append(root + url)
+        elif url[0] in '?#' or _re_not_plain_relative.search(url) :
+            joined.append(_urljoin(base, url))
+        else :
+            joined.append(directory + url)
+    return joined
+
+# --------------------------------------------------------------------
+
+class _Retry(urllib3.util.Retry) :
+    """
+    Retry policy with a capped Retry-After : a server may ask to wait
+    for hours
+    """
+
+    def __init__(self, *args, retry_after_cap=60, **kwargs) :
+        super().__init__(*args, **kwargs)
+        self.retry_after_cap = retry_after_cap
+
+    def new(self, **kwargs) :
+        # urllib3 recrée l'objet à chaque tentative
+        kwargs.setdefault('retry_after_cap', self.retry_after_cap)
+        return super().new(**kwargs)
+
+    def get_retry_after(self, response) :
+        retry_after = super().get_retry_after(response)
+        if retry_after is None :
+            return None
+        return min(retry_after, self.retry_after_cap)
 
 # --------------------------------------------------------------------
 
 class WebService(Service) :
 
+    retry_status = (429, 500, 502, 503, 504)
+    # attente maximale demandée par Retry-After, en secondes
+    retry_after_cap = 60
+
+    def __init__(self, opener=None, cache=None, pool_size=10, timeout=(5, 30), retries=3, backoff=0.5) :
+        self._pool_size = pool_size
+        self._retries = retries
+        self._backoff = backoff
+        self.timeout = timeout
+        super().__init__(opener)
+        self.cache = cache
+
     @Service.opener.setter
     def opener(self, opener) :
         if opener is None :
             self._opener = requests.Session()
+            self._mount_adapter()
         else :
             self._opener = opener
 
+    def _retry(self) :
+        options = {
+            'total' : self._retries,
+            # délai de lecture dépassé : pas de nouvel essai, l'attente
+            # serait multipliée
+            'read' : False,
+            'backoff_factor' : self._backoff,
+            'status_forcelist' : self.retry_status,
+            'respect_retry_after_header' : True,
+            # le dernier statut remonte à raise_for_status
+            'raise_on_status' : False,
+            'retry_after_cap' : self.retry_after_cap,
+        }
+        try :
+            return _Retry(backoff_jitter=self._backoff, **options)
+        except TypeError :
+            # urllib3 < 2 : pas de jitter
+            return _Retry(**options)
+
+    def _mount_adapter(self) :
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self._pool_size,
+            pool_maxsize=self._pool_size,
+            max_retries=self._retry()
+        )
+        self._opener.mount('http://', adapter)
+        self._opener.mount('https://', adapter)
+
+    def configure(self, pool_size=None, retries=None, backoff=None) :
+        """
+        Reconfigure connection pool size and retry policy of the session
+        """
+        if pool_size is not None :
+            self._pool_size = pool_size
+        if retries is not None :
+            self._retries = retries
+        if backoff is not None :
+            self._backoff = backoff
+        self._mount_adapter()
+
+    @property
+    def pool_size(self) :
+        return self._pool_size
+
+    @property
+    def retries(self) :
+        return self._retries
+
+    @property
+    def backoff(self) :
+        return self._backoff
+
+    @property
+    def timeout(self) :
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, timeout) :
+        # (connect, read) ou une valeur unique
+        self._timeout = timeout
+
+    @property
+    def cache(self) :
+        return self._cache
+
+    @cache.setter
+    def cache(self, cache) :
+        self._cache = cache
+
     @property
     def headers(self) :
         return self._opener.headers
@@ -46,9 +202,13 @@ class WebService(Service) :
         response = self.get(url)
         return response.json()
 
-    def get(self, url) :
+    def get(self, url, stream=False, headers=None) :
         try :
-            response = self.opener.get(url)
+            if stream :
+                # flux : le corps n'est pas lu, pas de cache
+                response = self._request(url, stream=True, headers=headers)
+            else :
+                response = self._get_cached(url, headers)
             response.raise_for_status()
 
         except requests.exceptions.MissingSchema as e :
@@ -60,14 +220,52 @@ class WebService(Service) :
         except requests.exceptions.InvalidURL as e :
             raise ServiceError(f'InvalidURL - {e}')
 
+        except requests.Timeout as e :
+            raise ServiceError(f'Timeout - {e}')
+
         except requests.ConnectionError as e :
+            # délai de lecture dépassé, remonté par urllib3 dans un MaxRetryError
+            reason = getattr(e.args[0], 'reason', None) if e.args else None
+            if isinstance(reason, urllib3.exceptions.ReadTimeoutError) :
+                raise ServiceError(f'Timeout - {e}')
             raise ServiceError(f'ConnectionError - {e}')
 
         except requests.HTTPError as e :
-            raise ServiceError(f'HTTPError - {e}')
+            # la réponse reste accessible par __cause__
+            raise ServiceError(f'HTTPError - {e}') from e
         
         return response
-        
+
+    def _request(self, url, **kwargs) :
+        return self.opener.get(url, timeout=self.timeout, **kwargs)
+
+    def _get_cached(self, url, headers=None) :
+        if self.cache is None :
+            return self._request(url, headers=headers)
+
+        conditional = self.cache.conditional_headers(url)
+        response = self._request(url, headers={**(headers or {}), **conditional})
+        if conditional and response.status_code == 304 :
+            cached = self.cache.revalidated(url, response)
+            if cached is not None :
+                log.debug(f'not modified - {url}')
+                return cached
+            # entrée évincée entre temps : requête complète
+            response = self._request(url, headers=headers)
+
+        self.cache.store(url, response)
+        return response
+
+    @classmethod
+    def decode(cls, response) :
+        """
+        Decode the body of a response once, with the sniffed charset
+        """
+        charset_parser = CharsetHTMLParser()
+        charset_parser.parse(response.content, response.headers.get('Content-Type'))
+        log.debug(f'charset - {charset_parser.charset}')
+        return codecs.decode(response.content, encoding=charset_parser.charset, errors='replace')
+
     @classmethod
     def domain(cls, url) :
         url_split = urllib.parse.urlsplit(url)
@@ -75,6 +273,23 @@ class WebService(Service) :
 
 # --------------------------------------------------------------------
 
+class SessionPool(ObjectPool) :
+    """
+    Shared pool of sessions configured like WebService's : a session is
+    checked out by one thread at a time, and its kept-alive connections
+    serve the next checkout
+    """
+
+    def __init__(self, maxsize=4, **kwargs) :
+        super().__init__(maxsize)
+        # pool_size, retries, backoff de WebService
+        self._kwargs = kwargs
+
+    def _create(self, params) :
+        return WebService(**self._kwargs).opener
+
+# --------------------------------------------------------------------
+
 class WebRequest(WebService) :
 
     def __call__(self, url) :
@@ -84,25 +299,19 @@ class WebRequest(WebService) :
 
 class GrabService(WebService) :
 
-    def __init__(self, opener=None) :
-        super().__init__(opener)
+    def __init__(self, opener=None, cache=None, **kwargs) :
+        super().__init__(opener, cache, **kwargs)
 
         self.parser = ImageLinkHTMLParser()
         self._url = None
         self._head = '.*'
         self._ext = '',
+        self._memo = (None, {})
 
     def _grab(self, url) :
-        charset_parser = CharsetHTMLParser()
         try :
             response = self.get(url)
-            page = response.content
-            charset_parser.parse(page)
-            log.debug(f'charset - {charset_parser.charset}')
-            decoded_page = codecs.decode(page, encoding=charset_parser.charset, errors='replace')
-            log.debug(f'{decoded_page == response.text}')
-            #self.parser.parse(decoded_page, url)
-            self.parser.parse(response.text, url)
+            self.parser.parse(self.decode(response), url)
             self._url = url
         except ServiceError as e :
             log.error(f'ServiceError - {e}')
@@ -111,6 +320,94 @@ class GrabService(WebService) :
     def update(self) :
         self._grab(self.url)
 
+    def grab_stream(self, url, chunk_size=64*1024) :
+        """
+        Stream a page through the incremental parser, yield (image, link)
+        as soon as the elements are parsed, before the download completes
+        """
+        re_head, re_ext = self._matchers()
+        response = self.get(url, stream=True)
+        try :
+            chunks = response.iter_content(chunk_size)
+            first = next(chunks, b'')
+            charset_parser = CharsetHTMLParser()
+            charset_parser.parse(first, response.headers.get('Content-Type'))
+            log.debug(f'charset - {charset_parser.charset}')
+
+            self._url = url
+            pairs = self.parser.stream(itertools.chain([first], chunks), charset_parser.libxml2_charset)
+            for image, link in pairs :
+                if re_head.search(os.path.basename(image)) and re_ext.search(image) :
+                    yield _urljoin(url, image), _urljoin(url, link)
+
+        except requests.RequestException as e :
+            log.error(f'ServiceError - {e}')
+            raise ServiceError(f'ServiceError - {e}')
+
+        finally :
+            response.close()
+
+    def grab_many(self, urls, max_workers=8, max_per_domain=2) :
+        """
+        Grab several pages concurrently, yield (url, images_links) as completed
+        """
+        # une file par domaine : au plus max_per_domain pages d'un domaine
+        # en cours, sans occuper les workers des autres domaines
+        queues = {}
+        for url in urls :
+            queues.setdefault(self.domain(url), collections.deque()).append(url)
+        running = collections.Counter()
+        pending = {}
+
+        def grab(url) :
+            # un parser par page : ImageLinkHTMLParser conserve son état
+            parser = ImageLinkHTMLParser(self.parser.config, self.parser.paired)
+            response = self.get(url)
+            parser.parse(self.decode(response), url)
+            return self._filter(url, parser.images_links)
+
+        def submit() :
+            # tour de rôle : une page par domaine disponible à chaque passage
+            while len(pending) < max_workers :
+                submitted = False
+                for domain, queue in list(queues.items()) :
+                    if len(pending) >= max_workers :
+                        break
+                    if running[domain] >= max_per_domain :
+                        continue
+                    url = queue.popleft()
+                    if not queue :
+                        del queues[domain]
+                    running[domain] += 1
+                    pending[executor.submit(grab, url)] = (url, domain)
+                    submitted = True
+                if not submitted :
+                    break
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        try :
+            while True :
+                submit()
+                if not pending :
+                    break
+                done, _ = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done :
+                    url, domain = pending.pop(future)
+                    running[domain] -= 1
+                    try :
+                        yield url, future.result()
+                    except ServiceError as e :
+                        log.error(f'ServiceError - {e}')
+                        yield url, {}
+                    except Exception as e :
+                        # une page illisible n'interrompt pas les autres
+                        log.error(f'{type(e).__name__} - {url} : {e}')
+                        yield url, {}
+        finally :
+            executor.shutdown(wait=True, cancel_futures=True)
+
     @property
     def url(self) :
         return self._url
@@ -139,26 +436,46 @@ class GrabService(WebService) :
     def ext(self, ext) :
         self._ext = tuple(ext)
 
-    @property
-    def images_links(self) :
+    def _matchers(self) :
         re_head = re.compile(self.head)
         log.debug('IMAGES_LINKS head="{.pattern}"'.format(re_head))
         re_ext = re.compile('\\.('+'|'.join(self.ext)+')\\?*')
         log.debug('IMAGES_LINKS ext="{.pattern}"'.format(re_ext))
+        return re_head, re_ext
+
+    def _filter(self, url, parsed_images_links) :
+        re_head, re_ext = self._matchers()
 
         images_links = {}
         try :
-            images_links = {
-                urllib.parse.urljoin(self.url, image) : urllib.parse.urljoin(self.url, link)
-                for image, link in self.parser.images_links.items()
+            selected = [
+                (image, link) for image, link in parsed_images_links.items()
                 if re_head.search(os.path.basename(image))
                 and re_ext.search(image)
-            }
+            ]
+            images_links = dict(zip(
+                urljoin_many(url, (image for image, _ in selected)),
+                urljoin_many(url, (link for _, link in selected))
+            ))
         except Exception as e :
             log.debug(repr(e))
 
         return images_links
 
+    @property
+    def images_links(self) :
+        # reconstruit seulement si url, head, ext ou le résultat du parser changent
+        key = (self.url, self.head, self.ext, self.parser, self.parser.generation)
+        memo_key, images_links = self._memo
+        if memo_key != key :
+            images_links = self._filter(self.url, self.parser.images_links)
+            self._memo = (key, images_links)
+        return images_links
+
+    @property
+    def next_pages(self) :
+        return urljoin_many(self.url, self.parser.next_pages)
+
     @property
     def images(self) :
         return list(self.images_links.keys())
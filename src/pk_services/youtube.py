@@ -6,12 +6,20 @@ log = logging.getLogger(__name__)
 log.debug('MODULE {}'.format(__name__))
 
 import re
+import json
+import bisect
+import functools
+import itertools
+import concurrent.futures
 import yt_dlp as youtube_dl
+import yt_dlp.extractor
+from yt_dlp.utils import LazyList
 
-from .core import Service
+from .core import Service, ObjectPool
+from .resolver import StreamResolver
 from .exceptions import ServiceError
 
-__all__ = [ 'YoutubeService' ]
+__all__ = [ 'YoutubeService', 'YoutubeDLPool', 'rerank_formats' ]
 
 # --------------------------------------------------------------------
 
@@ -21,13 +29,130 @@ def grab_height(chaine) :
 
 # --------------------------------------------------------------------
 
+@functools.lru_cache(maxsize=1024)
+def video_key(url) :
+    """
+    'Extractor:id' for an url an extractor recognizes offline, else the url
+    """
+    for ie in yt_dlp.extractor.gen_extractor_classes() :
+        if ie.ie_key() == 'Generic' :
+            break
+        if ie.suitable(url) :
+            temp_id = ie.get_temp_id(url)
+            if temp_id :
+                return f'{ie.ie_key()}:{temp_id}'
+            break
+    return url
+
+# --------------------------------------------------------------------
+
+def rerank_formats(ytdl, infos) :
+    """
+    Copy of infos with its formats sorted and selected again by ytdl
+    (format_sort, format), without a new extraction
+    """
+    if not infos or not infos.get('formats') :
+        return infos
+    infos = dict(infos, formats=list(infos['formats']))
+    ytdl.sort_formats(infos)
+    selector = ytdl.format_selector or ytdl.build_format_selector(
+        ytdl._default_format_spec(infos)
+    )
+    best = next(iter(ytdl._select_formats(infos['formats'], selector)), None)
+    if best is not None :
+        # champs du format retenu précédemment
+        infos.pop('requested_formats', None)
+        infos.update(best)
+    return infos
+
+# --------------------------------------------------------------------
+
+class YoutubeDLPool(ObjectPool) :
+    """
+    Pool of reusable YoutubeDL instances keyed by their params : an
+    instance is checked out by one thread at a time, then kept warm
+    (extractors already initialized) for the next lookup
+    """
+
+    def _create(self, params) :
+        # YoutubeDL complète et conserve le dict reçu : copie
+        return youtube_dl.YoutubeDL(dict(params))
+
+# --------------------------------------------------------------------
+
+class HeightIndex :
+    """
+    Formats of an info dict sorted by numeric height, parsed once,
+    looked up by bisection
+    """
+
+    heights = re.compile('[0-9]+')
+
+    def __init__(self, infos) :
+        # identifier la clé utilisée
+        keywd = ''
+        if 'quality' in infos :
+            keywd = 'quality'
+        if 'format' in infos :
+            keywd = 'format'
+        if 'height' in infos :
+            keywd = 'height'
+        self.keywd = keywd
+
+        # (hauteur, position) : à hauteur égale, l'ordre d'origine
+        indexed = sorted(
+            (self.height(entry[keywd]), pos, entry)
+            for pos, entry in enumerate(infos.get('formats', []))
+            if entry.get(keywd)
+        )
+        self._heights = [ height for height, _, _ in indexed ]
+        self._formats = [ entry for _, _, entry in indexed ]
+
+    def __len__(self) :
+        return len(self._formats)
+
+    @classmethod
+    def height(cls, value) :
+        return max(map(int, cls.heights.findall(f'{value}#0')))
+
+    def select(self, max_height=None) :
+        """
+        Lowest format at least max_height high, else the highest one
+        """
+        if not self._formats :
+            raise ValueError('no format to select')
+        if max_height is not None :
+            try :
+                i = bisect.bisect_left(self._heights, max_height)
+                if i < len(self._heights) :
+                    return self._formats[i]
+            except TypeError :
+                pass
+        return self._formats[bisect.bisect_left(self._heights, self._heights[-1])]
+
+# --------------------------------------------------------------------
+
 class YoutubeService(Service) :
 
+    # pool partagé par défaut entre les instances
+    pool = YoutubeDLPool()
+
     def __init__(self, *args, **kwargs) :
         super().__init__(opener=None)
         self._url = None
         self._current = 0
         self._infos = {}
+        self._cache = None
+        self._height_index = {}
+        self._lazy = False
+        self._prefetch = 2
+        self._entries = None
+        self._resolved = {}
+        self._pending = {}
+        self._executor = None
+        # YoutubeDL du générateur des entrées d'une playlist lazy
+        self._pager = None
+        self._resolver = None
         self._params = {
             'skip_download' : True,
             'playliststart' : 1,
@@ -40,6 +165,16 @@ class YoutubeService(Service) :
     def _set_params(self, params) :
         if 'format_sort' in params :
             self.format_sort = params['format_sort']
+        if 'cache' in params :
+            self.cache = params['cache']
+        if 'lazy' in params :
+            self.lazy = params['lazy']
+        if 'prefetch' in params :
+            self.prefetch = params['prefetch']
+        if 'pool' in params :
+            self.pool = params['pool']
+        if 'resolver' in params :
+            self.resolver = params['resolver']
 
     def __getitem__(self, key) :
         # implements : self[key]
@@ -47,13 +182,236 @@ class YoutubeService(Service) :
 
     def update(self) :
         self._current = 0
+        self._cancel_prefetch()
+        self._close_pager()
+        if self.lazy :
+            self._update_lazy()
+            return
+
+        if self.cache is not None :
+            infos = self.cache.get(self._cache_key(self._url))
+            if infos is not None :
+                log.debug(f'cached infos - {self._url}')
+                self._set_infos(infos)
+                return
         try :
-            with youtube_dl.YoutubeDL(self._params) as ytdl :
+            with self.pool.checkout(self._params) as ytdl :
                 infos = ytdl.extract_info(self._url)
-                self._infos = ytdl.sanitize_info(infos)
+                self._set_infos(ytdl.sanitize_info(infos))
+            if self.cache is not None :
+                self.cache.store(self._cache_key(self._url), self._infos)
         except (youtube_dl.DownloadError, TypeError) as e :
             log.error(e)
-            self._infos = {'error' : e }
+            self._set_infos({'error' : e })
+
+    def _update_lazy(self) :
+        # extraction à plat : les entrées ne sont résolues qu'à la demande
+        ytdl = self.pool.create(self._params)
+        try :
+            infos = ytdl.extract_info(self._url, process=False)
+            if infos.get('_type') == 'playlist' :
+                # instance réservée : le générateur des entrées s'en sert
+                # page après page, elle ne retourne pas au pool
+                self._pager, ytdl = ytdl, None
+            else :
+                infos = ytdl.sanitize_info(ytdl.process_ie_result(infos, download=False))
+        except (youtube_dl.DownloadError, TypeError) as e :
+            log.error(e)
+            self._set_infos({'error' : e })
+            return
+        finally :
+            if ytdl is not None :
+                ytdl.close()
+
+        if self._pager is None :
+            self._set_infos(infos)
+            return
+        end = self.playlist_end if self.playlist_end > 0 else None
+        entries = itertools.islice(infos.get('entries') or [], self.playlist_start - 1, end)
+        self._set_infos(dict(infos, entries=LazyList(entries)))
+
+    def _resolve(self, entry, cached=True) :
+        if cached and self.cache is not None and entry.get('url') :
+            infos = self.cache.get(self._cache_key(entry['url']))
+            if infos is not None :
+                return infos
+        try :
+            with self.pool.checkout(self._params) as ytdl :
+                infos = ytdl.sanitize_info(ytdl.process_ie_result(dict(entry), download=False))
+        except (youtube_dl.DownloadError, TypeError) as e :
+            log.error(e)
+            return {'error' : e }
+        if self.cache is not None and entry.get('url') :
+            self.cache.store(self._cache_key(entry['url']), infos)
+        return infos
+
+    def rerank(self) :
+        """
+        Sort and select the formats again with the current format_sort,
+        locally on the formats already extracted
+        """
+        with self.pool.checkout(self._params) as ytdl :
+            if self._entries is not None :
+                # les résolutions en cours utilisent l'ancien tri
+                for future in self._pending.values() :
+                    future.cancel()
+                self._pending = {}
+                self._resolved = {
+                    num : rerank_formats(ytdl, infos)
+                    for num, infos in self._resolved.items()
+                }
+                # index construits sur les anciens formats
+                self._height_index = {}
+                return
+            if self.is_playlist :
+                entries = self._infos.get('entries') or []
+                infos = dict(self._infos, entries=[
+                    rerank_formats(ytdl, entry) for entry in entries
+                ])
+            else :
+                infos = rerank_formats(ytdl, self._infos)
+        self._set_infos(infos)
+        if self.cache is not None :
+            self.cache.store(self._cache_key(self._url), self._infos)
+
+    def _submit(self, num) :
+        if num in self._resolved or num in self._pending :
+            return
+        try :
+            entry = self._entries[num]
+        except IndexError :
+            return
+        if self._executor is None :
+            self._executor = concurrent.futures.ThreadPoolExecutor(max(1, self.prefetch))
+        self._pending[num] = self._executor.submit(self._resolve, entry)
+
+    def _lazy_entry(self, num) :
+        if num not in self._resolved :
+            future = self._pending.pop(num, None)
+            if future is None or future.cancel() :
+                # pas encore commencée : résolue ici, sans attendre les
+                # préchargements en cours
+                self._resolved[num] = self._resolve(self._entries[num])
+            else :
+                self._resolved[num] = future.result()
+        # préchargement des entrées suivantes
+        for ahead in range(num + 1, num + 1 + self.prefetch) :
+            self._submit(ahead)
+        return self._resolved[num]
+
+    def _close_pager(self) :
+        pager, self._pager = self._pager, None
+        if pager is not None :
+            pager.close()
+
+    def _cancel_prefetch(self) :
+        for future in self._pending.values() :
+            future.cancel()
+        self._pending = {}
+        self._resolved = {}
+
+    def _refresh_infos(self, url) :
+        # le cache rendrait les mêmes urls signées
+        infos = self._resolve({ '_type' : 'url', 'url' : url }, cached=False)
+        if infos.get('error') is not None :
+            raise ServiceError(f"url: {url} - reason: {infos['error']}")
+        return infos
+
+    def _fresh(self, num, infos) :
+        if self._resolver is None or not infos or not infos.get('webpage_url') :
+            return infos
+        fresh = self._resolver.get(infos['webpage_url'], infos)
+        if fresh is not infos :
+            # infos rafraîchies : remplacer l'entrée et son index
+            self._height_index.pop(num, None)
+            if num is None :
+                self._infos = fresh
+            elif self._entries is not None :
+                self._resolved[num] = fresh
+            else :
+                self._infos['entries'][num] = fresh
+        return fresh
+
+    def _playlist_entry(self, num) :
+        if self._entries is not None :
+            return self._lazy_entry(num)
+        return self._infos['entries'][num]
+
+    def _set_infos(self, infos) :
+        self._infos = infos
+        self._entries = None
+        # index des hauteurs construit une fois au chargement
+        self._height_index = {}
+        if self.is_playlist and isinstance(infos.get('entries'), LazyList) :
+            self._entries = infos['entries']
+        elif self.is_playlist :
+            for num, entry in enumerate(infos.get('entries') or []) :
+                if entry and 'formats' in entry :
+                    self._height_index[num] = HeightIndex(entry)
+        elif 'formats' in infos :
+            self._height_index[None] = HeightIndex(infos)
+
+    def _get_height_index(self, num, infos) :
+        try :
+            return self._height_index[num]
+        except KeyError :
+            index = self._height_index[num] = HeightIndex(infos)
+            return index
+
+    def _cache_key(self, url) :
+        # les formats retenus dépendent du tri et de la plage demandée
+        return json.dumps([
+            video_key(url), self.format_sort,
+            self.playlist_start, self.playlist_end
+        ])
+
+    def peek(self, url) :
+        """
+        Cached infos of url without extraction, stream urls may be stale
+        """
+        if self.cache is None :
+            return None
+        return self.cache.get(self._cache_key(url), streams=False)
+
+    @property
+    def cache(self) :
+        return self._cache
+
+    @cache.setter
+    def cache(self, cache) :
+        # InfoCache
+        self._cache = cache
+
+    @property
+    def resolver(self) :
+        return self._resolver
+
+    @resolver.setter
+    def resolver(self, resolver) :
+        # True : StreamResolver qui extrait avec les paramètres du service
+        if resolver is True :
+            resolver = StreamResolver(self._refresh_infos)
+        if self._resolver is not None and self._resolver is not resolver :
+            self._resolver.close()
+        self._resolver = None if resolver is False else resolver
+
+    @property
+    def lazy(self) :
+        return self._lazy
+
+    @lazy.setter
+    def lazy(self, lazy) :
+        # lazy : playlist extraite à plat, entrées résolues à la demande
+        self._lazy = bool(lazy)
+
+    @property
+    def prefetch(self) :
+        return self._prefetch
+
+    @prefetch.setter
+    def prefetch(self, prefetch) :
+        # nombre d'entrées suivantes résolues en arrière plan
+        self._prefetch = max(0, int(prefetch))
 
     @property
     def format_sort(self) :
@@ -62,7 +420,12 @@ class YoutubeService(Service) :
     @format_sort.setter
     def format_sort(self, fmtsort) :
         self._params['format_sort'] = fmtsort.split(',')
-        if self._url is not None :
+        if self._url is None :
+            return
+        # pas de nouvelle extraction si les formats sont déjà là
+        if self._infos and self._infos.get('error') is None :
+            self.rerank()
+        else :
             self.update()
 
     @property
@@ -110,9 +473,9 @@ class YoutubeService(Service) :
     @property
     def infos(self) :
         if self.is_playlist :
-            return self._infos['entries'][self.current]
+            return self._fresh(self.current, self._playlist_entry(self.current))
         else :
-            return self._infos
+            return self._fresh(None, self._infos)
 
     @property
     def url(self) :
@@ -145,6 +508,14 @@ class YoutubeService(Service) :
 
     @property
     def count(self) :
+        if self._entries is not None :
+            total = self._infos.get('playlist_count')
+            if total is None :
+                # total inconnu : entrées lues jusqu'à la courante et ses
+                # suivantes, sans épuiser le générateur
+                return len(self._entries[:self._current + 1 + self.prefetch])
+            end = self.playlist_end if self.playlist_end > 0 else total
+            return max(0, min(total, end) - self.playlist_start + 1)
         return self.infos.get('n_entries', 1)
 
     @property
@@ -153,6 +524,15 @@ class YoutubeService(Service) :
 
     @current.setter
     def current(self, num) :
+        if self._entries is not None and self._infos.get('playlist_count') is None :
+            # entrées lues jusqu'à num seulement
+            num = max(0, num)
+            try :
+                self._entries[num]
+            except IndexError :
+                num = max(0, len(self._entries) - 1)
+            self._current = num
+            return
         self._current = min(num, self.count - 1)
 
     def validate(self) :
@@ -194,36 +574,30 @@ class YoutubeService(Service) :
         if 'formats' not in self.infos :
             return self.infos
 
-        # identifier la clé utilisée
-        keywd = ''
-        heights = re.compile('[0-9]+')
-        if 'quality' in self.infos :
-            keywd = 'quality'
-        if 'format' in self.infos :
-            keywd = 'format'
-        if 'height' in self.infos :
-            keywd = 'height'
-        log.debug(f'select_format : key="{keywd}"')
+        num = self.current if self.is_playlist else None
+        index = self._get_height_index(num, self.infos)
+        log.debug(f'select_format : key="{index.keywd}"')
+        return index.select(max_height)
 
-        # preselection clés
-        dct_k = [
-            entry for entry in self.infos['formats']
-            if entry.get(keywd)
-        ]
+    def select_formats(self, max_height=None) :
+        """
+        Selection d'un format video pour chaque entrée de la playlist
+        """
+        assert self.validate()
+        if not self.is_playlist :
+            return [ self.select_format(max_height) ]
 
-        try :
-            # preselection height
-            selected = min([
-                entry for entry in dct_k
-                if max(map(int, heights.findall(f'{entry[keywd]}#0'))) >= max_height
-                ],
-                key=lambda x : max(map(int, heights.findall(f'{x[keywd]}#0')))
-            )
-        except (ValueError, TypeError) :
-            selected = max(
-                dct_k,
-                key=lambda x : max(map(int, heights.findall(f'{x[keywd]}#0')))
-            )
+        if self._entries is not None :
+            entries = map(self._playlist_entry, range(self.count))
+        else :
+            entries = self._infos.get('entries') or []
+
+        selected = []
+        for num, entry in enumerate(entries) :
+            if 'formats' not in entry :
+                selected.append(entry)
+            else :
+                selected.append(self._get_height_index(num, entry).select(max_height))
         return selected
 
     def video(self, max_height=None) :
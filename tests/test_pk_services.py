@@ -1,9 +1,36 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+import unittest.mock
+import codecs
 import pathlib
+import time
+import tempfile
+import threading
+import contextlib
+import types
+import collections
+import requests
+import http.server
+import urllib.parse
+import lxml.html
 import pk_services
 
+from pk_services.core import ObjectPool
+from pk_services.cache import ResponseCache, InfoCache, PageCache, url_expiry
+from pk_services.parsers import CharsetHTMLParser, ImageLinkHTMLParser, libxml2_encoding
+from pk_services.web import WebService, GrabService, SessionPool, urljoin_many
+from pk_services.domains import PublicSuffixList
+from pk_services.downloads import DownloadService
+from pk_services.crawler import BloomFilter, GrabCrawler
+from pk_services.youtube import HeightIndex, YoutubeDLPool, YoutubeService
+from pk_services.resolver import StreamResolver
+from pk_services.exceptions import ServiceError
+from pk_services.lastfm import Playlist, LastFmUrl, LastFmChart, ChartRow
+from pk_services.entries import EntryStore, PlaylistCursor
+from pk_services.m3u import M3UItem, read_m3u, write_m3u
+from yt_dlp.utils import OnDemandPagedList
+
 from . import locator
 
 # ---
@@ -18,6 +45,817 @@ class Test_00_global(unittest.TestCase) :
 
     def test_00_Trivial(self) :
         assert True, 'True basic trivial test'
-        
+
+# ---
+
+def make_response(url, body, status=200, headers=None) :
+    response = requests.Response()
+    response.url = url
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = body
+    return response
+
+class Test_01_cache(unittest.TestCase) :
+
+    def setUp(self) :
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(self.tmpdir.name, max_size=10)
+
+    def tearDown(self) :
+        self.tmpdir.cleanup()
+
+    def test_00_revalidate(self) :
+        url = 'http://example.org/a'
+        response = make_response(url, b'abcd', headers={'ETag' : '"v1"'})
+        self.assertTrue(self.cache.store(url, response))
+        self.assertEqual(self.cache.conditional_headers(url), {'If-None-Match' : '"v1"'})
+        cached = self.cache.revalidated(url, make_response(url, b'', status=304))
+        self.assertEqual(cached.content, b'abcd')
+        self.assertEqual(cached.status_code, 200)
+
+    def test_01_no_validator(self) :
+        url = 'http://example.org/a'
+        self.assertFalse(self.cache.store(url, make_response(url, b'abcd')))
+        self.assertEqual(self.cache.conditional_headers(url), {})
+
+    def test_02_lru_eviction(self) :
+        headers = {'Last-Modified' : 'Mon, 01 Jan 2024 00:00:00 GMT'}
+        for name in 'abc' :
+            url = f'http://example.org/{name}'
+            self.cache.store(url, make_response(url, b'1234', headers=headers))
+        self.assertNotIn('http://example.org/a', self.cache)
+        self.assertIn('http://example.org/c', self.cache)
+        self.assertLessEqual(self.cache.size, 10)
+        self.assertEqual(len(ResponseCache(self.tmpdir.name)), 2)
+
+    def test_03_url_expiry(self) :
+        self.assertEqual(url_expiry('https://r1.googlevideo.com/videoplayback?expire=1700000000&ei=x'), 1700000000)
+        self.assertEqual(url_expiry('https://manifest.googlevideo.com/api/manifest/hls/expire/1700000000/ei/x'), 1700000000)
+        self.assertIsNone(url_expiry('https://example.org/video.mp4'))
+
+    def test_04_info_cache(self) :
+        cache = InfoCache(self.tmpdir.name, ttl=3600, margin=60)
+        soon = int(time.time()) + 30
+        info = {
+            'id' : 'abc', 'title' : 'A title',
+            'formats' : [{'format_id' : '18', 'url' : f'https://host/v?expire={soon}'}],
+        }
+        cache.store('abc', info)
+        # urls valides moins longtemps que la marge : seules les métadonnées restent
+        self.assertIsNone(cache.get('abc'))
+        self.assertEqual(cache.get('abc', streams=False)['title'], 'A title')
+        info['formats'][0]['url'] = f'https://host/v?expire={soon + 3600}'
+        cache.store('abc', info)
+        self.assertEqual(cache.get('abc'), info)
+
+    def test_05_page_cache(self) :
+        cache = PageCache(ttl=3600, maxsize=1)
+        page = {'url' : 'http://e/final'}
+        cache.store('http://e/requested', 'http://e/final', page)
+        self.assertIs(cache.get('http://e/requested'), page)
+        self.assertIs(cache.get('http://e/final'), page)
+        cache.store('http://e/other', 'http://e/other', {})
+        self.assertIsNone(cache.get('http://e/requested'))
+        cache.ttl = -1
+        cache.store('http://e/other', 'http://e/other', {})
+        self.assertNotIn('http://e/other', cache)
+
+# ---
+
+class Test_02_charset(unittest.TestCase) :
+
+    def charset(self, data, content_type=None) :
+        parser = CharsetHTMLParser()
+        parser.parse(data, content_type)
+        return parser.charset
+
+    def test_00_header_first(self) :
+        data = b'<meta charset="iso-8859-1">'
+        self.assertEqual(self.charset(data, 'text/html; charset=UTF-8'), 'utf-8')
+
+    def test_01_meta(self) :
+        self.assertEqual(self.charset(b'<head><meta charset="ISO-8859-1">'), 'iso8859-1')
+        data = b'<meta http-equiv="Content-Type" content="text/html; charset=windows-1252">'
+        self.assertEqual(self.charset(data, 'text/html'), 'cp1252')
+
+    def test_02_bounded_prefix(self) :
+        data = b' ' * CharsetHTMLParser.prefix_size + b'<meta charset="latin-1">'
+        self.assertEqual(self.charset(data), 'utf-8')
+
+    def test_03_unknown(self) :
+        self.assertEqual(self.charset(b'<meta charset="nope"><meta charset="utf-16">'), 'utf-16')
+
+# ---
+
+GALLERY = '''<html><body>
+<a href="/p1"><img src="1.jpg"></a>
+<a href="/p2"><img src="2.jpg"><img src="3.jpg"></a>
+<a href="/p3">no image</a>
+<a href="/p4"><img src="4.jpg"></a>
+</body></html>'''
+
+class Test_03_image_link_parser(unittest.TestCase) :
+
+    def test_00_compiled_once(self) :
+        parser = ImageLinkHTMLParser()
+        compiled = parser.config.find_compiled('http://www.example.org/')
+        self.assertIs(compiled, parser.config.find_compiled('http://example.org/a'))
+        parser.config.add_domain('example.org', '//img/@src', '//a/@href')
+        self.assertIsNot(compiled, parser.config.find_compiled('http://example.org/a'))
+
+    def test_01_find_domain(self) :
+        parser = ImageLinkHTMLParser()
+        config = parser.config
+        config.update({
+            'example.co.uk' : ['//img/@src', '//a/@href'],
+            'pics.example.co.uk' : ['//img/@src', '//a/@href'],
+            'co.uk' : ['//img/@src', '//a/@href'],
+        })
+        self.assertEqual(config.find_domain('http://www.example.co.uk/a'), 'example.co.uk')
+        self.assertEqual(config.find_domain('http://a.pics.example.co.uk:8080/'), 'pics.example.co.uk')
+        self.assertEqual(config.find_domain('http://other.co.uk/'), 'co.uk')
+        self.assertEqual(config.find_domain('http://example.org/'), 'default')
+        config.public_suffixes = PublicSuffixList.load()
+        self.assertEqual(config.find_domain('http://other.co.uk/'), 'default')
+
+    def test_02_public_suffixes(self) :
+        psl = PublicSuffixList(['co.uk', 'uk', '*.ck', '!www.ck'])
+        self.assertEqual(psl.registered_domain('www.example.co.uk'), 'example.co.uk')
+        self.assertEqual(psl.registered_domain('a.b.c.ck'), 'b.c.ck')
+        self.assertEqual(psl.registered_domain('www.ck'), 'www.ck')
+        self.assertIsNone(psl.registered_domain('co.uk'))
+
+    def test_03_paired(self) :
+        parser = ImageLinkHTMLParser(paired=True)
+        parser.parse(GALLERY, 'http://example.org/')
+        self.assertEqual(parser.images_links, {
+            '1.jpg' : '/p1', '2.jpg' : '/p2', '3.jpg' : '/p2', '4.jpg' : '/p4'
+        })
+
+    def test_04_stream(self) :
+        data = GALLERY.encode('utf-8')
+        chunks = (data[i:i+16] for i in range(0, len(data), 16))
+        parser = ImageLinkHTMLParser()
+        pairs = list(parser.stream(chunks, 'utf-8'))
+        self.assertEqual(pairs, [
+            ('1.jpg', '/p1'), ('2.jpg', '/p2'), ('3.jpg', '/p2'), ('4.jpg', '/p4')
+        ])
+        self.assertEqual(len(parser.images_links), 4)
+
+        # BOM utf-8 : 'utf-8-sig' inconnu de libxml2
+        data = codecs.BOM_UTF8 + '<a href="/é"><img src="é.jpg"></a>'.encode('utf-8')
+        charset_parser = CharsetHTMLParser()
+        charset_parser.parse(data)
+        self.assertEqual(charset_parser.charset, 'utf-8-sig')
+        self.assertEqual(list(parser.stream([data], charset_parser.charset)), [('é.jpg', '/é')])
+        self.assertEqual(libxml2_encoding('euc_jp'), 'EUC-JP')
+
+# ---
+
+class Test_04_grab_service(unittest.TestCase) :
+
+    def test_00_urljoin_many(self) :
+        urls = [
+            'a.jpg', '/b.jpg', 'http://other.org/c', '../d', './e', '//cdn/f',
+            'g//h', '?q', '#f', 'x;y', ' z', 'mailto:me', 'i/../j', '', 'k?',
+        ]
+        for base in ('http://example.org', 'http://example.org/dir/page.html?p=1', 'http://example.org/a/../b') :
+            self.assertEqual(
+                urljoin_many(base, urls),
+                [urllib.parse.urljoin(base, url) for url in urls]
+            )
+
+    def test_01_images_links_memo(self) :
+        grab = GrabService()
+        grab._url = 'http://example.org/'
+        grab.parser.parse(GALLERY, grab.url)
+        images_links = grab.images_links
+        self.assertIs(images_links, grab.images_links)
+        self.assertEqual(len(images_links), 3)
+        grab.ext = ['png']
+        self.assertEqual(grab.images_links, {})
+        grab.ext = ['jpg']
+        grab.parser.parse(GALLERY, grab.url)
+        self.assertIsNot(images_links, grab.images_links)
+        self.assertEqual(images_links, grab.images_links)
+
+    def test_02_grab_many(self) :
+        grab = GrabService()
+        lock = threading.Lock()
+        active = collections.Counter()
+        peaks = collections.Counter()
+        started = []
+
+        def get(url, stream=False, headers=None) :
+            domain = grab.domain(url)
+            with lock :
+                started.append(domain)
+                active[domain] += 1
+                active['*'] += 1
+                peaks[domain] = max(peaks[domain], active[domain])
+                peaks['*'] = max(peaks['*'], active['*'])
+            time.sleep(0.3 if 'slow' in url else 0.05)
+            with lock :
+                active[domain] -= 1
+                active['*'] -= 1
+            if 'error' in url :
+                raise ServiceError(f'HTTPError - {url}')
+            body = b'' if 'empty' in url else GALLERY.encode('utf-8')
+            return make_response(url, body, headers={'Content-Type' : 'text/html; charset=utf-8'})
+
+        grab.get = get
+        urls = [ 'http://slow.org/' ] + [ f'http://a.org/{num}' for num in range(6) ]
+        urls += [ 'http://b.org/error', 'http://b.org/empty' ]
+        results = list(grab.grab_many(urls, max_workers=4, max_per_domain=2))
+
+        self.assertEqual(sorted(url for url, _ in results), sorted(urls))
+        # au fil des réponses : la page lente arrive en dernier
+        self.assertEqual(results[-1][0], 'http://slow.org/')
+        self.assertTrue(results[-1][1])
+        self.assertEqual(dict(results)['http://b.org/error'], {})
+        self.assertEqual(dict(results)['http://b.org/empty'], {})
+        self.assertLessEqual(peaks['a.org'], 2)
+        self.assertLessEqual(peaks['*'], 4)
+        # pas de worker bloqué sur a.org pendant que b.org attend
+        self.assertEqual(sorted(started[:4]), ['a.org', 'a.org', 'b.org', 'slow.org'])
+
+    def serve(self) :
+        hits = collections.Counter()
+
+        class Handler(http.server.BaseHTTPRequestHandler) :
+            def do_GET(self) :
+                hits[self.path] += 1
+                if self.path == '/slow' :
+                    time.sleep(0.5)
+                if self.path == '/flaky' and hits[self.path] < 3 :
+                    self.send_response(503)
+                    self.send_header('Retry-After', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, *args) :
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.daemon_threads = True
+        # client parti avant la réponse lente
+        server.handle_error = lambda request, address : None
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f'http://127.0.0.1:{server.server_address[1]}', hits
+
+    def test_03_retry(self) :
+        root, hits = self.serve()
+        web = WebService(timeout=(1, 0.2), backoff=0)
+        self.assertEqual(web.get(f'{root}/flaky').content, b'ok')
+        self.assertEqual(hits['/flaky'], 3)
+
+        # délai de lecture : une seule tentative, remontée comme Timeout
+        with self.assertRaises(ServiceError) as cm :
+            web.get(f'{root}/slow')
+        self.assertTrue(str(cm.exception).startswith('Timeout'))
+        self.assertEqual(hits['/slow'], 1)
+
+        retry = web._retry()
+        response = unittest.mock.Mock(headers={'Retry-After' : '3600'})
+        self.assertEqual(retry.new(total=1).get_retry_after(response), WebService.retry_after_cap)
+
+    def test_04_session_pool(self) :
+        pool = SessionPool(maxsize=1, retries=1)
+        with pool.checkout() as first :
+            with pool.checkout() as second :
+                self.assertIsNot(first, second)
+        self.assertEqual(len(pool), 1)
+        with pool.checkout() as third :
+            self.assertIn(third, (first, second))
+        self.assertEqual(third.get_adapter('http://e/').max_retries.total, 1)
+        pool.clear()
+        self.assertEqual(len(pool), 0)
+
+# ---
+
+class Test_05_crawler(unittest.TestCase) :
+
+    def test_00_bloom_filter(self) :
+        seen = BloomFilter(capacity=10000, error_rate=1e-3)
+        urls = [f'http://example.org/page/{i}' for i in range(10000)]
+        self.assertTrue(all(seen.add(url) for url in urls[:5000]))
+        self.assertFalse(any(seen.add(url) for url in urls[:5000]))
+        self.assertTrue(all(url in seen for url in urls[:5000]))
+        false_positives = sum(url in seen for url in urls[5000:])
+        self.assertLess(false_positives, 25)
+
+    def test_01_next_pages(self) :
+        parser = ImageLinkHTMLParser()
+        parser.config.add_domain('example.org', '//img/@src', '//a/@href', '//a[@rel="next"]/@href')
+        parser.parse('<a href="/p"><img src="1.jpg"></a><a rel="next" href="?page=2">></a>', 'http://example.org/')
+        self.assertEqual(parser.next_pages, ['?page=2'])
+
+    def test_02_crawl_errors(self) :
+        crawler = GrabCrawler(delay=0, max_workers=2)
+        pages = {
+            'http://example.org/' : '<a href="/p"><img src="1.jpg"></a><a rel="next" href="/2">></a>',
+            'http://example.org/2' : '',
+        }
+        crawler.grab.parser.config.add_domain('example.org', '//img/@src', '//a/@href', '//a[@rel="next"]/@href')
+
+        def get(url, stream=False, headers=None) :
+            if url.endswith('broken') :
+                raise ValueError(url)
+            if url not in pages :
+                raise ServiceError(f'HTTPError - {url}')
+            return make_response(url, pages[url].encode('utf-8'), headers={'Content-Type' : 'text/html; charset=utf-8'})
+
+        crawler.grab.get = get
+        pairs = list(crawler.crawl('http://example.org/', 'http://example.org/missing', 'http://example.org/broken'))
+        self.assertEqual(pairs, [('http://example.org/1.jpg', 'http://example.org/p')])
+        self.assertIn('http://example.org/2', crawler.seen)
+
+# ---
+
+FORMATS = [
+    {'format_id' : '18', 'format' : '18 - 640x360', 'height' : 360},
+    {'format_id' : '22', 'format' : '22 - 1280x720', 'height' : 720},
+    {'format_id' : '140', 'format' : '140 - audio only', 'height' : None},
+    {'format_id' : '137', 'format' : '137 - 1920x1080', 'height' : 1080},
+    {'format_id' : '136', 'format' : '136 - 1280x720', 'height' : 720},
+]
+
+class Test_06_youtube(unittest.TestCase) :
+
+    def test_00_height_index(self) :
+        index = HeightIndex({'height' : 720, 'formats' : FORMATS})
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.select(480)['format_id'], '22')
+        self.assertEqual(index.select(720)['format_id'], '22')
+        self.assertEqual(index.select(2160)['format_id'], '137')
+        self.assertEqual(index.select()['format_id'], '137')
+
+    def test_01_ytdl_pool(self) :
+        pool = YoutubeDLPool(maxsize=1)
+        params = { 'quiet' : True }
+        with pool.checkout(params) as first :
+            with pool.checkout(params) as second :
+                self.assertIsNot(first, second)
+        self.assertEqual(len(pool), 1)
+        with pool.checkout(dict(params)) as third :
+            self.assertIn(third, (first, second))
+        self.assertNotIn('outtmpl', params)
+        pool.clear()
+        self.assertEqual(len(pool), 0)
+        with self.assertRaises(TypeError) :
+            ObjectPool()
+
+    def test_02_rerank(self) :
+        service = YoutubeService(pool=YoutubeDLPool())
+        service._params.update(logger=None, verbose=False, quiet=True)
+        formats = [
+            dict(fmt, url=f"http://e/{fmt['format_id']}.mp4", ext='mp4', vcodec='avc1', acodec='mp4a')
+            for fmt in FORMATS if fmt['height']
+        ]
+        service._url = 'http://e/x'
+        service._set_infos({'id' : 'x', 'title' : 't', 'formats' : formats, 'format_id' : '137'})
+        # pas de nouvelle extraction
+        service.update = self.fail
+        service.format_sort = 'res:360'
+        self.assertEqual(service['format_id'], '18')
+        self.assertEqual(service.select_format(720)['height'], 720)
+
+    def lazy_service(self, total=100) :
+        read = []
+        calls = []
+
+        def entries() :
+            for num in range(total) :
+                read.append(num)
+                yield {'_type' : 'url', 'url' : f'http://e/{num}'}
+
+        class YDL :
+            closed = False
+
+            def extract_info(self, url, process=True) :
+                return {'_type' : 'playlist', 'id' : 'p', 'entries' : entries()}
+
+            def process_ie_result(self, entry, download=True) :
+                calls.append((entry['url'], threading.current_thread()))
+                used.append(self)
+                return {'id' : entry['url'], 'title' : entry['url'], 'webpage_url' : entry['url']}
+
+            def sanitize_info(self, infos) :
+                return infos
+
+            def close(self) :
+                self.closed = True
+
+        class Pool(YoutubeDLPool) :
+            def _create(self, params) :
+                return YDL()
+
+        used = self.used = []
+
+        service = YoutubeService(pool=Pool(), lazy=True, prefetch=2)
+        service.url = 'http://e/p'
+        return service, read, calls
+
+    def test_03_lazy_count(self) :
+        service, read, calls = self.lazy_service()
+        # total inconnu : pas de lecture de toute la playlist
+        self.assertEqual(service.count, 3)
+        service.current = 5
+        self.assertEqual(service.current, 5)
+        self.assertEqual(service.count, 8)
+        self.assertLess(len(read), 10)
+        service.current = 1000
+        self.assertEqual(service.current, 99)
+
+        # le générateur garde son propre YoutubeDL, hors du pool
+        pager = service._pager
+        self.assertEqual(service['title'], 'http://e/99')
+        service.current = 90
+        self.assertEqual(service['title'], 'http://e/90')
+        for future in list(service._pending.values()) :
+            future.result()
+        self.assertEqual(len(self.used), 4)
+        self.assertNotIn(pager, self.used)
+        service.update()
+        self.assertTrue(pager.closed)
+        self.assertIsNot(service._pager, pager)
+
+    def test_04_lazy_current(self) :
+        service, read, calls = self.lazy_service()
+        service.prefetch = 1
+        self.assertEqual(service['title'], 'http://e/0')
+        # entrée courante résolue sur place, la suivante en arrière plan
+        self.assertEqual(calls[0], ('http://e/0', threading.main_thread()))
+        self.assertEqual(list(service._pending), [1])
+
+        # entrée en attente derrière un préchargement : résolue sur place
+        blocker = threading.Event()
+        service._executor.submit(blocker.wait)
+        service._submit(5)
+        service.current = 5
+        self.assertEqual(service['title'], 'http://e/5')
+        self.assertIn(('http://e/5', threading.main_thread()), calls)
+        blocker.set()
+
+        service._get_height_index(5, {'height' : 720, 'formats' : FORMATS})
+        service.rerank()
+        self.assertEqual(service._height_index, {})
+
+class Test_07_resolver(unittest.TestCase) :
+
+    def test_00_background_refresh(self) :
+        calls = []
+
+        def resolve(key) :
+            calls.append(key)
+            expire = int(time.time()) + 3
+            return {'url' : f'http://e/{key}?expire={expire}', 'n' : len(calls)}
+
+        with StreamResolver(resolve, margin=2.5, min_interval=0.1) as resolver :
+            first = resolver.get('a')
+            self.assertIs(resolver.get('a'), first)
+            deadline = time.time() + 3
+            while resolver.refreshed == 0 and time.time() < deadline :
+                time.sleep(0.05)
+            self.assertEqual(resolver.refreshed, 1)
+            self.assertEqual(resolver.get('a')['n'], 2)
+            self.assertEqual(calls, ['a', 'a'])
+
+    def test_01_failed_refresh(self) :
+        calls = []
+
+        def resolve(key) :
+            calls.append(key)
+            if len(calls) > 1 :
+                raise ServiceError(f'url: {key} - reason: gone')
+            return {'url' : f'http://e/{key}?expire={int(time.time()) + 3}'}
+
+        with StreamResolver(resolve, margin=2.5, min_interval=0.1) as resolver :
+            first = resolver.get('a')
+            deadline = time.time() + 3
+            # échec en arrière plan : nouvel essai tant que l'url reste valide
+            while len(calls) < 3 and time.time() < deadline :
+                time.sleep(0.05)
+            self.assertGreaterEqual(len(calls), 3)
+            self.assertEqual(resolver.refreshed, 0)
+            # entrée expirée, résolution impossible : dernière info connue
+            resolver._entries['a'] = (first, time.time() - 1, time.time() + 60)
+            self.assertIs(resolver.get('a'), first)
+
+    def test_02_idle_entries(self) :
+        calls = []
+
+        def resolve(key) :
+            calls.append(key)
+            # échéance entre 0.5 et 1.5 s, après idle_ttl
+            return {'url' : f'http://e/{key}?expire={int(time.time()) + 4}'}
+
+        with StreamResolver(resolve, margin=2.5, min_interval=0.1, idle_ttl=0.2, maxsize=2) as resolver :
+            for key in 'abc' :
+                resolver.get(key)
+            # bornée : la moins récemment lue est retirée
+            self.assertEqual(len(resolver), 2)
+            self.assertNotIn('a', resolver)
+            # plus lues : retirées à l'échéance, sans nouvelle résolution
+            deadline = time.time() + 3
+            while len(resolver) and time.time() < deadline :
+                time.sleep(0.05)
+            self.assertEqual(len(resolver), 0)
+            self.assertEqual(calls, ['a', 'b', 'c'])
+
+CHARTLIST = '''<html><body><table class="chartlist">
+<tr class="chartlist-row">
+  <td class="chartlist-index">1</td>
+  <td class="chartlist-play"><a class="chartlist-play-button" href="https://www.youtube.com/watch?v=v1"
+    data-artist-name="Artist" data-track-name="Song">Play</a></td>
+  <td class="chartlist-name"><a href="/music/Artist/_/Song">Song</a></td>
+  <td class="chartlist-artist"><a href="/music/Artist">Artist</a></td>
+  <td class="chartlist-duration"> 3:45 </td>
+  <td class="chartlist-bar"><span class="chartlist-count-bar-value">1,234<span> listeners</span></span></td>
+</tr>
+<tr class="chartlist-row">
+  <td class="chartlist-play"><a class="chartlist-play-button" href="https://www.youtube.com/watch?v=v2"
+    data-artist-name="Other" data-track-name="Track">Play</a></td>
+</tr>
+<tr class="chartlist-row"><td class="chartlist-play"></td></tr>
+</table></body></html>'''
+
+class Test_08_playlist(unittest.TestCase) :
+
+    def test_00_prefetch(self) :
+        playlist = Playlist(prefetch=2)
+        playlist._cache.extend({'_type' : 'url', 'url' : f'http://e/{num}'} for num in range(5))
+        playlist.restart()
+        resolved = []
+
+        def info(ie_result, ytdl=None) :
+            resolved.append(ie_result['url'])
+            return {'title' : ie_result['url']}
+
+        playlist.info = info
+        self.assertEqual(playlist.info_next(), {'title' : 'http://e/0'})
+        self.assertEqual(len(playlist._queue), 2)
+        playlist.skip()
+        self.assertEqual(playlist.info_next(), {'title' : 'http://e/2'})
+        playlist.restart()
+        self.assertEqual(len(playlist._queue), 0)
+        self.assertEqual(playlist.info_next(), {'title' : 'http://e/0'})
+
+    def test_01_entry_store(self) :
+        flat = [
+            {'_type' : 'url', 'ie_key' : 'Youtube', 'id' : f'v{num}', 'url' : f'http://e/v{num}', 'title' : f't{num}'}
+            for num in range(4)
+        ]
+        store = EntryStore(maxsize=3)
+        self.assertEqual(store.extend(flat[:2]), 2)
+        self.assertEqual(store.extend(flat[:2]), 0)
+        self.assertEqual(store.extend(flat), 2)
+        self.assertEqual([ entry.id for entry in store ], ['v1', 'v2', 'v3'])
+        self.assertEqual(store[0].ie_result(), flat[1])
+        store.truncate(1)
+        self.assertEqual(len(store), 1)
+
+        # retirées pendant le même appel : non comptées
+        store = EntryStore(maxsize=3)
+        self.assertEqual(store.extend(flat), 3)
+        self.assertEqual(store.evicted, 1)
+
+    def test_02_page_url(self) :
+        url = LastFmUrl(artist='Muse')
+        self.assertEqual(url.page_url(1), url.url)
+        self.assertEqual(
+            url.page_url(3),
+            'https://www.last.fm/music/Muse/+tracks?date_preset=LAST_7_DAYS&page=3'
+        )
+
+    def test_03_chart_rows(self) :
+        first, second, empty = ChartRow.rows(lxml.html.fromstring(CHARTLIST))
+        self.assertEqual(
+            (first.artist, first.track, first.link, first.duration, first.listeners),
+            ('Artist', 'Song', 'https://www.youtube.com/watch?v=v1', 225, 1234)
+        )
+        self.assertEqual(second.ie_result(), {
+            '_type' : 'url', 'url' : 'https://www.youtube.com/watch?v=v2', 'title' : 'Other - Track'
+        })
+        self.assertIsNone(empty.link)
+
+    def test_04_cursor(self) :
+        pages = []
+
+        def page(num) :
+            pages.append(num)
+            return [ {'_type' : 'url', 'url' : f'http://e/{num * 10 + i}'} for i in range(10) ]
+
+        playlist = Playlist(batch=15)
+        playlist._infos = {'_type' : 'playlist', 'entries' : OnDemandPagedList(page, 10)}
+        playlist.extract_info()
+        playlist.extract_info()
+        self.assertEqual(playlist.cache_size, 30)
+        self.assertEqual(pages, [0, 1, 2])
+        playlist.cursor.seek(10)
+        playlist.extract_info()
+        self.assertEqual(playlist.cache_size, 30)
+
+        cursor = PlaylistCursor(iter(range(12)))
+        self.assertEqual(cursor.next_batch(5), [0, 1, 2, 3, 4])
+        cursor.seek(8)
+        self.assertEqual(cursor.next_batch(5), [8, 9, 10, 11])
+        self.assertTrue(cursor.exhausted)
+
+    def test_05_m3u(self) :
+        with tempfile.TemporaryDirectory() as tmpdir :
+            playlist = Playlist()
+            playlist._cache.extend(
+                {'_type' : 'url', 'url' : f'http://e/{num}', 'title' : f'A, "{num}"', 'duration' : 60 + num}
+                for num in range(3)
+            )
+            # titres connus : aucun YoutubeDL
+            playlist.pool = unittest.mock.Mock(checkout=self.fail)
+            self.assertEqual(playlist.save_m3u('test', directory=tmpdir), 3)
+            path = playlist.m3u_path('test', tmpdir)
+            write_m3u(path, [M3UItem('http://e/logo', 'Logo', attrs={'tvg-logo' : 'http://i/1.png'})], append=True)
+
+            items = list(read_m3u(path))
+            self.assertEqual(path.read_text(encoding='utf-8').count('#EXTM3U'), 1)
+            self.assertEqual(items[-1].logo, 'http://i/1.png')
+            self.assertEqual([ item.to_entry() for item in items[:3] ], list(playlist._cache))
+
+            loaded = Playlist()
+            self.assertEqual(loaded.load_m3u('test', directory=tmpdir), 4)
+            self.assertEqual(loaded.next_entry()['title'], 'A, "0"')
+
+            # load_m3u -> save_m3u : attributs conservés
+            self.assertEqual(loaded.save_m3u('copy', directory=tmpdir), 4)
+            self.assertEqual(list(read_m3u(loaded.m3u_path('copy', tmpdir))), items)
+
+            # fichier plus grand que max_entries
+            bounded = Playlist(max_entries=2)
+            with self.assertLogs('pk_services.lastfm', 'WARNING') :
+                self.assertEqual(bounded.load_m3u('test', directory=tmpdir), 2)
+            self.assertEqual(bounded.cache_size, 2)
+            self.assertEqual(bounded.load_m3u('test', directory=tmpdir, max_entries=10), 2)
+            self.assertEqual(bounded.cache_size, 4)
+
+            # ajout : seules les nouvelles entrées sont écrites
+            self.assertEqual(playlist.save_m3u('test', directory=tmpdir, append=True), 0)
+            playlist._cache.add({'_type' : 'url', 'url' : 'http://e/3', 'title' : 'B', 'duration' : 1})
+            self.assertEqual(playlist.save_m3u('test', directory=tmpdir, append=True), 1)
+            self.assertEqual([ item.url for item in read_m3u(path) ][-2:], ['http://e/logo', 'http://e/3'])
+
+    def test_06_play_streams(self) :
+        playlist = Playlist()
+        playlist.ytdl_params = { 'quiet' : True, 'verbose' : False }
+        played = []
+
+        class Player :
+            mpv_options = playlist._mpv.mpv_options
+            add_options = staticmethod(lambda *options : played.append(('add', options)))
+            remove_options = staticmethod(lambda *options : played.append(('remove', options)))
+            play = staticmethod(lambda title, uri : played.append(('play', uri)) or unittest.mock.Mock())
+
+        playlist._mpv = Player()
+        headers = { 'User-Agent' : 'UA' }
+        formats = [
+            dict(fmt, url=f"http://e/{fmt['format_id']}.mp4", ext='mp4', vcodec='avc1', acodec='none', http_headers=headers)
+            for fmt in FORMATS if fmt['height']
+        ]
+        formats.append({'format_id' : '140', 'url' : 'http://e/140.m4a', 'ext' : 'm4a', 'vcodec' : 'none', 'acodec' : 'mp4a', 'http_headers' : headers})
+        info = {'id' : 'x', 'title' : 't', 'webpage_url' : 'http://e/x', 'formats' : formats}
+        playlist._play_info(info, height=720)
+
+        # flux résolus à la hauteur demandée, sans nouvelle résolution par mpv
+        add, play, remove = played
+        self.assertIn(play[1], ('http://e/22.mp4', 'http://e/136.mp4'))
+        self.assertEqual(add[1], ('ytdl=no', 'audio-file=http://e/140.m4a', 'user-agent=UA'))
+        self.assertEqual(remove, ('remove', add[1]))
+        self.assertEqual(Playlist._mpv_media({'webpage_url' : 'http://e/x'}), ('http://e/x', []))
+
+    def test_07_chart_waves(self) :
+        pages = {
+            1 : ['a', 'b'],
+            2 : ['b', 'c'],
+            3 : ['d'],
+            4 : [],
+            5 : ['e'],
+        }
+        fetched = []
+
+        def page_rows(num) :
+            fetched.append(num)
+            return [ types.SimpleNamespace(link=link) for link in pages.get(num, []) ]
+
+        chart = LastFmChart('https://www.last.fm/tag/rock/tracks', max_workers=2)
+        chart._page_rows = page_rows
+        # vagues de 2 pages, arrêt à la première page vide, sans doublon
+        self.assertEqual(chart.play_links(), ['a', 'b', 'c', 'd'])
+        self.assertEqual(sorted(fetched), [1, 2, 3, 4])
+
+        fetched.clear()
+        chart.max_tracks = 3
+        self.assertEqual(chart.play_links(), ['a', 'b', 'c'])
+        self.assertEqual(sorted(fetched), [1, 2])
+
+    def test_08_resolve_order(self) :
+        playlist = Playlist()
+        playlist.ytdl_params = { 'quiet' : True, 'verbose' : False }
+        playlist._cache.extend({'_type' : 'url', 'url' : f'http://e/{num}'} for num in range(6))
+        finished = []
+
+        def resolve(ie_result, ytdl=None) :
+            # les premières entrées finissent les dernières
+            num = int(ie_result['url'].rsplit('/', 1)[1])
+            time.sleep(0.05 * (5 - num))
+            finished.append(num)
+            return ie_result['url'], f't{num}', num
+
+        urls = [ f'http://e/{num}' for num in range(6) ]
+        resolved = list(playlist.resolve_all(max_workers=6, resolve=resolve))
+        self.assertEqual([ url for url, _, _ in resolved ], urls)
+        self.assertNotEqual(finished, sorted(finished))
+
+        playlist._m3u_entry = resolve
+        with tempfile.TemporaryDirectory() as tmpdir :
+            self.assertEqual(playlist.save_m3u('order', max_workers=6, directory=tmpdir), 6)
+            items = list(read_m3u(playlist.m3u_path('order', tmpdir)))
+        self.assertEqual([ item.url for item in items ], urls)
+        self.assertEqual([ item.title for item in items ], [ f't{num}' for num in range(6) ])
+
+# ---
+
+class Test_09_downloads(unittest.TestCase) :
+
+    def setUp(self) :
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.service = DownloadService(directory=self.tmpdir.name, max_workers=1, chunk_size=128)
+        self.bodies = {}
+        self.ranges = []
+
+        def request(url, stream=False, headers=None) :
+            body = self.bodies[url]
+            start = int((headers or {}).get('Range', 'bytes=0-')[6:-1])
+            self.ranges.append(start)
+            if start >= len(body) :
+                response = make_response(url, b'', status=416)
+            elif start :
+                response = make_response(url, body[start:], status=206)
+            else :
+                response = make_response(url, body)
+            if 'broken' in url and start :
+                response = make_response(url, b'', status=500)
+            response._content_consumed = True
+            return response
+
+        self.service._request = request
+
+    def test_00_resume(self) :
+        self.bodies['http://e/a.bin'] = body = bytes(range(256)) * 4
+        part = self.service._part('http://e/a.bin')
+        part.write_bytes(body[:300])
+
+        (url, path), = self.service.download(['http://e/a.bin'])
+        self.assertEqual(path.read_bytes(), body)
+        self.assertEqual(self.ranges, [300])
+        self.assertEqual((self.service.stats.resumed, self.service.stats.bytes), (1, len(body) - 300))
+        self.assertFalse(part.exists())
+
+    def test_01_restart(self) :
+        # fichier distant plus court que la partie déjà reçue : 416
+        self.bodies['http://e/b.bin'] = body = b'new content'
+        self.service._part('http://e/b.bin').write_bytes(b'old content, longer')
+        (url, path), = self.service.download(['http://e/b.bin'])
+        self.assertEqual(path.read_bytes(), body)
+        self.assertEqual(self.ranges, [19, 0])
+        self.assertEqual(self.service.stats.resumed, 0)
+
+        # autre erreur : partie conservée pour une reprise
+        self.bodies['http://e/broken.bin'] = body
+        part = self.service._part('http://e/broken.bin')
+        part.write_bytes(body[:3])
+        self.assertEqual(list(self.service.download(['http://e/broken.bin'])), [('http://e/broken.bin', None)])
+        self.assertEqual(part.read_bytes(), body[:3])
+        self.assertEqual(self.service.stats.errors, 1)
+
+    def test_02_duplicates(self) :
+        body = b'same' * 100
+        self.bodies.update({ 'http://e/1.bin' : body, 'http://e/2.bin' : body, 'http://e/3.bin' : b'other' })
+        paths = dict(self.service.download(self.bodies))
+        self.assertEqual(paths['http://e/2.bin'], paths['http://e/1.bin'])
+        stats = self.service.stats
+        self.assertEqual((stats.files, stats.duplicates, stats.bytes_saved), (2, 1, len(body)))
+        self.assertEqual(sorted(path.name for path in pathlib.Path(self.tmpdir.name).iterdir()), ['1.bin', '3.bin'])
+
+        # doublons entre deux exécutions
+        other = DownloadService(directory=self.tmpdir.name)
+        other.scan()
+        self.assertEqual(set(other._hashes.values()), set(paths.values()))
+
 if __name__ == '__main__' :
     unittest.main()